@@ -1,49 +1,35 @@
 import numpy as np
 import simpy
-import matplotlib.pyplot as plt
 import math
+import argparse
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from simlib import sampling, plotting
+from schedule import AIRPORT_2A
+import aggregate
+import arrivals
 
 T_guard = 60
 P_DELAY = 0.5
 SIM_TIME = 86400
 MU_DELAY = 500
+FIRST_PLANE = 5 #AM
+SCHEDULE = AIRPORT_2A
 
-def get_scheduled_time(time):
-    if time < 18000:
-        return None
-    elif time < 28800:
-        return np.random.exponential(120)
-    elif time < 39600:
-        return np.random.exponential(30)
-    elif time < 54000:
-        return np.random.exponential(150)
-    elif time < 72000:
-        return np.random.exponential(30)
-    elif time < 86400:
-        return np.random.exponential(120)
+# One stream per stochastic input, see sampling.stream_rng
+_exponential = sampling.exponential(stream="schedule")
+_uniform = sampling.uniform(stream="delay flag")
+_gamma3 = sampling.gamma(3, stream="delay length")
+
+def get_next_arrival(time):
+    return SCHEDULE.next_arrival(time, _exponential, T_guard)
 
 def is_delayed():
-    return np.random.choice([True, False], p=[P_DELAY, 1 - P_DELAY])
+    return _uniform() < P_DELAY
 
 def get_delayed_time():
-    return np.random.gamma(3, MU_DELAY)
-
-def take_means(planes):
-    prev = 0
-    means = []
-    IAs = []
-    for plane in planes:
-        hour = math.floor(plane.scheduled)
-        if hour == prev:
-            IAs.append(plane.inter_arrival)
-        else:
-            means.append(sum(IAs)/len(IAs))
-            IAs = [plane.inter_arrival]
-            prev = hour
-
-    means.append(sum(IAs)/len(IAs))
-
-    return means
+    return MU_DELAY*_gamma3()
 
 class Plane:
     def __init__(self, scheduled, inter_arrival):
@@ -58,40 +44,86 @@ class PlaneGenerator:
 
     def generate(self):
         delay = 0
-        while True:
-            t = self.env.now
-            T = get_scheduled_time(t)
-
-            if T is not None:
-                inter_arrival = np.maximum(T_guard, T)
-                self.planes.append(Plane(t/3600, inter_arrival + delay))
-                
-                if is_delayed():
-                    delay = get_delayed_time()
-                else:
-                    delay = 0
-
-                # TODO: Schedule plane
-
-                yield self.env.timeout(inter_arrival)
+        t = get_next_arrival(self.env.now)
+        while t != math.inf:
+            yield self.env.timeout(t - self.env.now)
+            t = get_next_arrival(self.env.now)
+
+            # The last plane before closing has no successor the same day
+            if t <= SCHEDULE.open_until(self.env.now):
+                inter_arrival = t - self.env.now
+                self.planes.append(Plane(self.env.now/3600, inter_arrival + delay))
+
+            if is_delayed():
+                delay = get_delayed_time()
             else:
-                self.planes.append(Plane(t/3600, 0))
-                yield self.env.timeout(1)
-
-env = simpy.Environment()
-
-gen = PlaneGenerator(env)
-
-env.run(until=SIM_TIME)
-
-means = take_means(gen.planes)
-
-
-plt.plot([i for i in range(len(means))], means)
-plt.xlabel('Hour')
-plt.ylabel('Inter-arrival time')
-plt.title('Mean inter-arrival time per hour (µ_delay=' + str(MU_DELAY) + ")", fontsize=16)
-plt.xlim(5,23)
-
-plt.show()
-
+                delay = 0
+
+def simulate(days=1):
+    env = simpy.Environment()
+
+    gen = PlaneGenerator(env)
+
+    env.run(until=days*SIM_TIME)
+
+    scheduled = np.array([p.scheduled for p in gen.planes])
+    return aggregate.hourly(scheduled*3600, [p.inter_arrival for p in gen.planes], fold=True)
+
+def simulate_numpy(days=1):
+    # Same study without an event loop: the schedule is just a cumulative sum
+    # of random variates, see arrivals.py
+    s = arrivals.generate(SCHEDULE, 0, days*SIM_TIME, T_guard, P_DELAY, MU_DELAY, sampling.default_rng())
+    # Like the SimPy version, each gap carries the previous plane's delay
+    previous_delay = np.concatenate(([0], s.delay[:-1]))
+    return aggregate.hourly(s.scheduled, s.inter_arrival + previous_delay, fold=True)
+
+def compare(days=1):
+    """
+        Both engines over the same days, as a check that the closed form
+        matches the event loop: per hour the two means and their difference
+        in standard errors, which should stay within about +-3.
+    """
+    # The NumPy engine draws from the shared generator and the SimPy one from
+    # the named streams, so the two runs are independent
+    fast = simulate_numpy(days)
+    slow = simulate(days)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        se = np.sqrt(fast["var"]/fast["count"] + slow["var"]/slow["count"])
+        return fast["mean"], slow["mean"], (fast["mean"] - slow["mean"])/se
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inter-arrival times per hour")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="seed")
+    parser.add_argument("-d", "--days", type=int, default=1, help="days to simulate")
+    parser.add_argument("-e", "--engine", choices=["numpy", "simpy", "compare"], default="numpy",
+                        help="vectorized schedule generator, the SimPy event loop, or both side by side")
+    plotting.add_arguments(parser)
+    args = parser.parse_args()
+    figures = plotting.Figures.from_args(args)
+
+    if args.seed is not None:
+        sampling.seed(args.seed)
+    if args.engine == "compare":
+        fast, slow, z = compare(args.days)
+        print("Hour   NumPy   SimPy  Diff/SE")
+        for hour in np.flatnonzero(~np.isnan(z)):
+            print("{:4d}  {:5.1f}s  {:5.1f}s  {:+7.2f}".format(hour, fast[hour], slow[hour], z[hour]))
+        sys.exit()
+    if args.engine == "numpy":
+        means = simulate_numpy(args.days)["mean"]
+    else:
+        means = simulate(args.days)["mean"]
+
+    for hour, mean in enumerate(means):
+        if not np.isnan(mean):
+            print("{:2d}: {:.1f}s".format(hour, mean))
+
+    if figures.wanted:
+        plt = figures.pyplot()
+        plt.plot([i for i in range(len(means))], means)
+        plt.xlabel('Hour')
+        plt.ylabel('Inter-arrival time')
+        plt.title('Mean inter-arrival time per hour (µ_delay=' + str(MU_DELAY) + ")", fontsize=16)
+        plt.xlim(5,23)
+
+        figures.done("2a")
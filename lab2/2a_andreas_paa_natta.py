@@ -1,7 +1,7 @@
 import numpy as np
 import simpy
 import matplotlib.pyplot as plt
-import math
+import aggregate
 
 T_guard = 60
 P_DELAY = 0.5
@@ -58,24 +58,6 @@ class PlaneGenerator:
             else:
                 yield self.env.timeout(1)
 
-def find_means_per_clock_hour(average_hours, inter_arrivals):
-    prev = FIRST_PLANE
-    means = []
-    IAs = []
-    for inter_arrival, average_hour in zip(inter_arrivals, average_hours):
-        hour = math.floor(average_hour)
-
-        if hour == prev:
-            IAs.append(inter_arrival[0])
-        else:
-            means.append(sum(IAs)/len(IAs))
-            IAs = [inter_arrival[0]]
-            prev = hour
-
-    means.append(sum(IAs)/len(IAs))
-
-    return means
-
 def simulate():
     env = simpy.Environment()
 
@@ -83,20 +65,12 @@ def simulate():
 
     env.run(until=SIM_TIME)
 
-    inter_arrival = []
-
-    gen.planes.sort(key=lambda x:x.arrival_time)
-
-    time = []
-
-    for i in range(len(gen.planes) - 1):
-        calc_time = (gen.planes[i+1].arrival_time+gen.planes[i].arrival_time)/2/3600
-
-        if calc_time < 24:
-            time.append((gen.planes[i+1].arrival_time+gen.planes[i].arrival_time)/2/3600)
-            inter_arrival.append([gen.planes[i+1].arrival_time - gen.planes[i].arrival_time])
+    # Inter-arrival times between consecutive (delayed) arrivals, binned by
+    # the hour of their midpoint
+    arrivals = np.sort([plane.arrival_time for plane in gen.planes])
+    midpoints = (arrivals[1:] + arrivals[:-1])/2
 
-    return find_means_per_clock_hour(time, inter_arrival)
+    return aggregate.hourly(midpoints, np.diff(arrivals))["mean"]
 
 
 MU_DELAYS = [0, 5400]
@@ -105,7 +79,7 @@ MU_DELAYS = [0, 5400]
 for delay in MU_DELAYS:
     MU_DELAY = delay
     means = simulate()
-    plt.plot([i for i in range(FIRST_PLANE, len(means)+FIRST_PLANE)], means)
+    plt.plot(range(len(means)), means)
 
 
 plt.xlabel('Time of day [Hours]')
@@ -1,73 +1,70 @@
 import numpy as np
 import simpy
-import matplotlib.pyplot as plt
 import math
+import argparse
+import functools
+from collections import namedtuple
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from simlib import sampling, sweep, plotting, replicate
+from simlib.stats import HourlyStats
+from simlib.records import RecordStore
+from schedule import AIRPORT_2A
+import aggregate
 
 P_DELAY = 0.5
 SIM_TIME = 86400
 MU_DELAY = 60
 FIRST_PLANE = 5 #AM
+SCHEDULE = AIRPORT_2A
 
 T_guard = 60 # seconds
 T_LANDING = 60 # seconds
 T_TAKEOFF = 60 # seconds
 MU_TURNAROUND = 45*60 # seconds
+NUM_RUNWAYS = 2
+PERCENTILES = (50, 90, 99) # per-hour queue time percentiles with --keep-planes
 
-def get_scheduled_time(time):
-    if time < 18000:
-        return None
-    elif time < 28800:
-        return np.random.exponential(120)
-    elif time < 39600:
-        return np.random.exponential(30)
-    elif time < 54000:
-        return np.random.exponential(150)
-    elif time < 72000:
-        return np.random.exponential(30)
-    elif time <= 86400:
-        return np.random.exponential(120)
-
-def is_delayed():
-    return np.random.choice([True, False], p=[P_DELAY, 1 - P_DELAY])
-
-def get_delayed_time():
-    return np.random.gamma(3, MU_DELAY)
-
-def get_turnaround_time():
-    return np.random.gamma(7, MU_TURNAROUND)
-
-def take_means(planes, what):
-    prev = FIRST_PLANE
-    means = [0]*FIRST_PLANE
-    thing = []
-    for plane in planes:
-        hour = math.floor(plane.arrival_time/3600)
-        if hour < 24:
-            if hour == prev:
-                if what == "landing":
-                    thing.append(plane.landing_q_time)
-                elif what == "takeoff":
-                    thing.append(plane.takeoff_q_time)
-            else:
-                means.append(sum(thing)/len(thing))
-                if what == "landing":
-                    thing = [plane.landing_q_time]
-                elif what == "takeoff":
-                    thing = [plane.takeoff_q_time]
-                
-                prev = hour
-    means.append(sum(thing)/len(thing))
-    return means
+# Everything a sweep may vary; defaults are the constants above
+Params = namedtuple("Params", ["P_DELAY", "MU_DELAY", "MU_TURNAROUND", "NUM_RUNWAYS"],
+                    defaults=[P_DELAY, MU_DELAY, MU_TURNAROUND, NUM_RUNWAYS])
+
+# One stream per stochastic input, so scenarios can share random numbers
+_exponential = sampling.exponential(stream="schedule")
+_uniform = sampling.uniform(stream="delay flag")
+_gamma3 = sampling.gamma(3, stream="delay length")
+_gamma7 = sampling.gamma(7, stream="turnaround")
+
+def get_next_arrival(time):
+    return SCHEDULE.next_arrival(time, _exponential, T_guard)
+
+def is_delayed(p_delay):
+    return _uniform() < p_delay
+
+def get_delayed_time(mu_delay):
+    return mu_delay*_gamma3()
+
+def get_turnaround_time(mu_turnaround):
+    return mu_turnaround*_gamma7()
+
+def plane_records():
+    return RecordStore(scheduled=float, arrival_time=float, landing_q_time=float, takeoff_q_time=float)
 
 class Plane:
-    def __init__(self, env, scheduled, delay, runways):
+    __slots__ = ("env", "stats", "records", "row", "arrival_time", "delay", "turnaround", "runways")
+
+    def __init__(self, env, scheduled, delay, turnaround, runways, stats, records=None):
         self.env = env
-        self.scheduled = scheduled
+        self.stats = stats
+        self.records = records
         self.arrival_time = scheduled + delay
         self.delay = delay
+        self.turnaround = turnaround
         self.runways = runways
-        self.landing_q_time = 0
-        self.takeoff_q_time = 0
+        # Queue times stay NaN in the records until the plane has taken off
+        if records is not None:
+            self.row = records.append(scheduled=scheduled, arrival_time=self.arrival_time)
         env.process(self.land())
 
     def land(self):
@@ -82,7 +79,7 @@ class Plane:
 
         landing_end = self.env.now
         
-        yield self.env.timeout(get_turnaround_time())
+        yield self.env.timeout(self.turnaround)
 
         takeoff_start = self.env.now
 
@@ -93,97 +90,169 @@ class Plane:
         
         takeoff_end = self.env.now
 
-        self.landing_q_time = (landing_end - landing_start) - T_LANDING
-        self.takeoff_q_time = (takeoff_end - takeoff_start) - T_TAKEOFF
+        landing_q_time = (landing_end - landing_start) - T_LANDING
+        takeoff_q_time = (takeoff_end - takeoff_start) - T_TAKEOFF
+
+        self.stats.add(self.arrival_time, landing=landing_q_time, takeoff=takeoff_q_time)
+        if self.records is not None:
+            self.records.landing_q_time[self.row] = landing_q_time
+            self.records.takeoff_q_time[self.row] = takeoff_q_time
 
 class PlaneGenerator:
-    def __init__(self, env, runways):
+    def __init__(self, env, runways, params, keep_planes=False):
         self.env = env
         self.runways = runways
-        self.planes = []
+        self.params = params
+        # Per-plane records are only kept on request, the stats don't need them
+        self.stats = HourlyStats(["landing", "takeoff"], fold=SIM_TIME > 86400)
+        self.records = plane_records() if keep_planes else None
         env.process(self.generate())
 
     def generate(self):
         delay = 0
         while True:
-            t = self.env.now
-            T = get_scheduled_time(t)
+            # Jumps straight over closed hours
+            t = get_next_arrival(self.env.now)
+            if t == math.inf:
+                return
+            yield self.env.timeout(t - self.env.now)
 
-            if T is not None:
-                if is_delayed():
-                    delay = get_delayed_time()
-                else:
-                    delay = 0
+            # Every plane draws from every stream in arrival order, whatever
+            # the parameters, so the streams stay in step across scenarios
+            delayed = is_delayed(self.params.P_DELAY)
+            length = get_delayed_time(self.params.MU_DELAY)
+            delay = length if delayed else 0
+            turnaround = get_turnaround_time(self.params.MU_TURNAROUND)
 
-                self.planes.append(Plane(self.env, t, delay, self.runways))
-                hold_time = np.maximum(T_guard, T)
-                yield self.env.timeout(hold_time)
-            else:
-                yield self.env.timeout(1)
+            Plane(self.env, t, delay, turnaround, self.runways, self.stats, self.records)
 
 
-def simulate():
+def simulate(params=Params(), keep_planes=False):
+    # Hourly mean landing and take-off queue times, plus the plane records
+    # with keep_planes (else None)
     env = simpy.Environment()
 
-    runways = simpy.PriorityResource(env, capacity=2)
-    gen = PlaneGenerator(env, runways)
+    runways = simpy.PriorityResource(env, capacity=params.NUM_RUNWAYS)
+    gen = PlaneGenerator(env, runways, params, keep_planes)
 
     env.run(until=SIM_TIME)
 
-    gen.planes.sort(key=lambda x:x.arrival_time)
-
-    landing_means = take_means(gen.planes, "landing")
-    takeoff_means = take_means(gen.planes, "takeoff")
-
-    return landing_means, takeoff_means
-
-legends = []
-
-"""
-MU_DELAYS = [0, 3600*1.5]
-i = 0
-for delay in MU_DELAYS:
-    MU_DELAY = delay
-    landing_means, takeoff_means = simulate()
-    if len(MU_DELAYS) == 1:
-        plt.plot([i for i in range(len(landing_means))], landing_means)
-        plt.plot([i for i in range(len(takeoff_means))], takeoff_means)
-    elif i == 0:
-        plt.plot([i for i in range(len(landing_means))], landing_means, "m")
-        plt.plot([i for i in range(len(takeoff_means))], takeoff_means, "m--")
-    else:
-        plt.plot([i for i in range(len(landing_means))], landing_means, "g")
-        plt.plot([i for i in range(len(takeoff_means))], takeoff_means, "g--")
-        
-    legends.append("Landing, µ = " + str(delay/3600) + " hour(s)")
-    legends.append("Take-off, µ = " + str(delay/3600) + " hour(s)")
-    
-    i+=1
-"""
-P_DELAYS = [0.1, 0.9]
-i = 0
-for delay in P_DELAYS:
-    P_DELAY = delay
-    landing_means, takeoff_means = simulate()
-    if len(P_DELAYS) == 1:
-        plt.plot([i for i in range(len(landing_means))], landing_means)
-        plt.plot([i for i in range(len(takeoff_means))], takeoff_means)
-    elif i == 0:
-        plt.plot([i for i in range(len(landing_means))], landing_means, "m")
-        plt.plot([i for i in range(len(takeoff_means))], takeoff_means, "m--")
-    else:
-        plt.plot([i for i in range(len(landing_means))], landing_means, "g")
-        plt.plot([i for i in range(len(takeoff_means))], takeoff_means, "g--")
-        
-    legends.append("Landing, P_delay = " + str(delay))
-    legends.append("Take-off, P_delay = " + str(delay))
-    
-    i+=1
-
-plt.legend(['Landing', 'Take-off'])
-plt.xlabel('Hour of day')
-plt.ylabel('Queue time (seconds)')
-plt.legend(legends)
-plt.title('Mean landing and take-off times', fontsize=16)
-
-plt.show()
\ No newline at end of file
+    landing_means, takeoff_means = gen.stats.mean()
+
+    return landing_means, takeoff_means, gen.records
+
+def queue_percentiles(records):
+    # Per-hour PERCENTILES of the landing and take-off queue times by arrival
+    # hour, indexed [metric, percentile, hour], straight from the record columns
+    q = np.vstack([records.column("landing_q_time"), records.column("takeoff_q_time")])
+    return aggregate.hourly(records.column("arrival_time"), q, percentiles=PERCENTILES,
+                            fold=SIM_TIME > 86400)["pct"]
+
+def sweep_point(params, seed, replications=1, antithetic=False, keep_planes=False):
+    """
+        One grid point as tidy rows per replication and hour. Replication r
+        runs on child r of `seed`; with antithetic it is the average of that
+        run and its mirror image, which counts as one replication. With
+        keep_planes the rows also get the hour's queue time percentiles
+        (landing_p90 etc.) from the per-plane records.
+    """
+    rows = []
+    for r, child in enumerate(seed.spawn(replications)):
+        sampling.seed(child)
+        landing_means, takeoff_means, records = simulate(params, keep_planes)
+        pct = queue_percentiles(records) if keep_planes else None
+        if antithetic:
+            sampling.seed(child, antithetic=True)
+            mirror = simulate(params, keep_planes)
+            landing_means = (landing_means + mirror[0])/2
+            takeoff_means = (takeoff_means + mirror[1])/2
+            if keep_planes:
+                pct = (pct + queue_percentiles(mirror[2]))/2
+        for hour, (landing, takeoff) in enumerate(zip(landing_means, takeoff_means)):
+            row = {"replication": r, "hour": hour, "landing": landing, "takeoff": takeoff}
+            if keep_planes:
+                for k, metric in enumerate(("landing", "takeoff")):
+                    for j, q in enumerate(PERCENTILES):
+                        row["{}_p{}".format(metric, q)] = pct[k, j, hour]
+            rows.append(row)
+    return rows
+
+def hourly(rows, metric):
+    # Rows of one point as an array indexed [replication, hour]
+    table = {}
+    for row in rows:
+        table[row["replication"], row["hour"]] = row[metric]
+    reps = 1 + max(r for r, _ in table)
+    hours = 1 + max(h for _, h in table)
+    return np.array([[table[r, h] for h in range(hours)] for r in range(reps)])
+
+def compare(a, b):
+    """
+        Prints the hourly difference b - a of two points with its CI over
+        replications. The variance ratio var(a) + var(b) over var(b - a) is
+        how many times more replications independent runs would need for the
+        same precision.
+    """
+    for metric in ("landing", "takeoff"):
+        x, y = hourly(a, metric), hourly(b, metric)
+        diff, half, count = replicate.confidence_interval(y - x)
+        print("{} queue time difference (95% CI) and variance reduction:".format(metric.capitalize()))
+        for hour in np.flatnonzero(count > 1):
+            xs, ys = x[:, hour], y[:, hour]
+            ok = ~np.isnan(xs) & ~np.isnan(ys)
+            d = np.var(ys[ok] - xs[ok], ddof=1)
+            ratio = (np.var(xs[ok], ddof=1) + np.var(ys[ok], ddof=1))/d if d > 0 else np.inf
+            print("  {:2d}: {:8.2f} +- {:7.2f} s   x{:.1f}".format(hour, diff[hour], half[hour], ratio))
+
+def label(params, swept):
+    return ", ".join("{} = {}".format(name, getattr(params, name)) for name in swept)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Airport parameter sweep")
+    parser.add_argument("-g", "--grid", action="append", default=[], metavar="NAME=v1,v2,...",
+                        help="parameter to sweep, any of {} (default: P_DELAY=0.1,0.9)".format(", ".join(Params._fields)))
+    parser.add_argument("-o", "--output", default="sweep.csv", help="CSV file the results are streamed to")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="master seed")
+    parser.add_argument("-n", "--replications", type=int, default=1, help="replications per grid point")
+    parser.add_argument("--independent", action="store_true",
+                        help="independent random numbers per point instead of common random numbers")
+    parser.add_argument("--antithetic", action="store_true", help="each replication is an antithetic pair of runs")
+    parser.add_argument("--keep-planes", action="store_true",
+                        help="keep per-plane records and add hourly queue time percentiles to the table")
+    plotting.add_arguments(parser)
+    args = parser.parse_args()
+    figures = plotting.Figures.from_args(args)
+
+    axes = dict(sweep.parse_axis(g) for g in args.grid) or {"P_DELAY": [0.1, 0.9]}
+    points = sweep.grid(Params(), **axes)
+
+    results = {}
+    fn = functools.partial(sweep_point, replications=args.replications, antithetic=args.antithetic,
+                           keep_planes=args.keep_planes)
+    for point, rows in sweep.run(fn, points, args.output, args.seed, args.workers, common=not args.independent):
+        print("Done: {} ({}/{})".format(label(point, axes), len(results) + 1, len(points)))
+        results[point] = rows
+
+    if len(points) == 2 and args.replications > 1:
+        compare(results[points[0]], results[points[1]])
+
+    if not figures.wanted:
+        sys.exit()
+
+    plt = figures.pyplot()
+    legends = []
+    for point in points:
+        landing, _, _ = replicate.confidence_interval(hourly(results[point], "landing"))
+        takeoff, _, _ = replicate.confidence_interval(hourly(results[point], "takeoff"))
+        line, = plt.plot(landing)
+        plt.plot(takeoff, "--", color=line.get_color())
+        legends.append("Landing, " + label(point, axes))
+        legends.append("Take-off, " + label(point, axes))
+
+    plt.xlabel('Hour of day')
+    plt.ylabel('Queue time (seconds)')
+    plt.legend(legends)
+    plt.title('Mean landing and take-off times', fontsize=16)
+
+    figures.done("2b_sweep")
@@ -1,7 +1,16 @@
 import numpy as np
 import simpy
-import matplotlib.pyplot as plt
 import math
+import argparse
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from simlib import sampling, replicate, plotting
+from simlib.stats import HourlyStats
+from simlib.records import RecordStore
+from schedule import AIRPORT_2C
+import aggregate
+from runway import Runways
 
 P_DELAY = 0.5
 SIM_TIME = 86400
@@ -16,80 +25,65 @@ NUM_DEICING_TRUCKS = 5
 T_guard = 60
 T_LANDING = 60
 T_TAKEOFF = 60
-T_PLOW = 60*10*NUM_RUNWAYS/NUM_PLOW_TRUCKS
+T_PLOW = 60*10 # per runway and truck
 T_DEICE = 60*10*1
 FIRST_PLANE = 5 #AM
+SCHEDULE = AIRPORT_2C
 
-def get_scheduled_time(time):
-    if time < 18000:
-        return None
-    elif time < 28800:
-        return np.random.exponential(3600/120)
-    elif time < 39600:
-        return np.random.exponential(3600/30)
-    elif time < 54000:
-        return np.random.exponential(3600/150)
-    elif time < 72000:
-        return np.random.exponential(3600/30)
-    elif time <= 86400:
-        return np.random.exponential(3600/120)
+# One stream per stochastic input, see sampling.stream_rng
+_exponential = sampling.exponential(stream="schedule")
+_uniform = sampling.uniform(stream="delay flag")
+_gamma3 = sampling.gamma(3, stream="delay length")
+_gamma7 = sampling.gamma(7, stream="turnaround")
+_weather = sampling.exponential(stream="weather")
+
+def get_next_arrival(time):
+    return SCHEDULE.next_arrival(time, _exponential, T_guard)
 
 def is_delayed():
-    return np.random.choice([True, False], p=[P_DELAY, 1 - P_DELAY])
+    return _uniform() < P_DELAY
 
 def get_delayed_time():
-    return np.random.gamma(3, MU_DELAY)
+    return MU_DELAY*_gamma3()
 
 def get_turnaround_time():
-    return np.random.gamma(7, MU_TURNAROUND)
+    return MU_TURNAROUND*_gamma7()
 
 def get_snow_time():
-    return np.random.exponential(BAD_WEATHER)
+    return BAD_WEATHER*_weather()
 
 def get_clear_time():
-    return np.random.exponential(GOOD_WEATHER)
+    return GOOD_WEATHER*_weather()
 
 def get_runway_fill_time():
-    return np.random.exponential(SNOW_TIME)
-
-def take_means(planes, what):
-    prev = 5
-    means = [0,0,0,0,0]
-    thing = []
-    for plane in planes:
-        hour = math.floor(plane.arrival_time/3600)
-        if hour < 24:
-            if hour == prev:
-                if what == "landing":
-                    thing.append(plane.landing_q_time)
-                elif what == "takeoff":
-                    thing.append(plane.takeoff_q_time)
-                elif what == "deicing":
-                    thing.append(plane.deicing_q_time)
-            else:
-                means.append(sum(thing)/len(thing))
-                if what == "landing":
-                    thing = [plane.landing_q_time]
-                elif what == "takeoff":
-                    thing = [plane.takeoff_q_time]
-                elif what == "deicing":
-                    thing.append(plane.deicing_q_time)
-                
-                prev = hour
-    means.append(sum(thing)/len(thing))
-    return means
+    return SNOW_TIME*_weather()
+
+def queue_stats(records):
+    # Per-hour landing, take-off and deicing queue time statistics by arrival
+    # hour, indexed [metric, hour]. Needs simulate(keep_planes=True); the
+    # streaming stats cover means and variances without it
+    q = np.vstack([records.column("landing_q_time"), records.column("takeoff_q_time"),
+                   records.column("deicing_q_time")])
+    return aggregate.hourly(records.column("arrival_time"), q, fold=SIM_TIME > 86400)
+
+def plane_records():
+    return RecordStore(scheduled=float, arrival_time=float, landing_q_time=float,
+                       takeoff_q_time=float, deicing_q_time=float)
 
 class Plane:
-    def __init__(self, env, scheduled, delay, runways, deicing_trucks):
+    __slots__ = ("env", "stats", "records", "row", "arrival_time", "delay", "runways", "deicing_trucks")
+
+    def __init__(self, env, scheduled, delay, runways, deicing_trucks, stats, records=None):
         self.env = env
-        self.scheduled = scheduled
+        self.stats = stats
+        self.records = records
         self.arrival_time = scheduled + delay
         self.delay = delay
         self.runways = runways
         self.deicing_trucks = deicing_trucks
-        self.landing_q_time = 0
-        self.takeoff_q_time = 0
-        self.deicing_q_time = 0
+        # Queue times stay NaN in the records until the plane has taken off
+        if records is not None:
+            self.row = records.append(scheduled=scheduled, arrival_time=self.arrival_time)
         env.process(self.land())
 
     def land(self):
@@ -97,7 +91,7 @@ class Plane:
 
         landing_start = self.env.now
 
-        with runways.request(priority=1) as req:
+        with self.runways.request(priority=1) as req:
             yield req
             yield self.env.timeout(T_LANDING)
 
@@ -107,7 +101,7 @@ class Plane:
 
         deicing_start = self.env.now
 
-        with deicing_trucks.request(priority=1) as req:
+        with self.deicing_trucks.request(priority=1) as req:
             yield req
             yield self.env.timeout(T_DEICE)
 
@@ -115,163 +109,157 @@ class Plane:
         
         takeoff_start = self.env.now
 
-        with runways.request(priority=2) as req:
+        with self.runways.request(priority=2) as req:
             yield req
             yield self.env.timeout(T_TAKEOFF)
         
         takeoff_end = self.env.now
 
-        self.landing_q_time = (landing_end - landing_start) - T_LANDING
-        self.takeoff_q_time = (takeoff_end - takeoff_start) - T_TAKEOFF
-        self.deicing_q_time = (deicing_end - deicing_start) - T_DEICE
+        landing_q_time = (landing_end - landing_start) - T_LANDING
+        takeoff_q_time = (takeoff_end - takeoff_start) - T_TAKEOFF
+        deicing_q_time = (deicing_end - deicing_start) - T_DEICE
+
+        self.stats.add(self.arrival_time, landing=landing_q_time,
+                       takeoff=takeoff_q_time, deicing=deicing_q_time)
+        if self.records is not None:
+            self.records.landing_q_time[self.row] = landing_q_time
+            self.records.takeoff_q_time[self.row] = takeoff_q_time
+            self.records.deicing_q_time[self.row] = deicing_q_time
 
 class PlaneGenerator:
-    def __init__(self, env, runways, deicing_trucks):
+    def __init__(self, env, runways, deicing_trucks, keep_planes=False):
         self.env = env
         self.runways = runways
         self.deicing_trucks = deicing_trucks
-        self.planes = []
+        # Queue times are collected as they happen; per-plane records are
+        # only kept if asked for
+        self.stats = HourlyStats(["landing", "takeoff", "deicing"], fold=SIM_TIME > 86400)
+        self.records = plane_records() if keep_planes else None
         env.process(self.generate())
 
     def generate(self):
         delay = 0
         while True:
-            t = self.env.now
-            T = get_scheduled_time(t)
-
-            if T is not None:
-                # Schedule plane
-                if is_delayed():
-                    delay = get_delayed_time()
-                else:
-                    delay = 0
-
-                self.planes.append(Plane(self.env, t, delay, self.runways, self.deicing_trucks))
-                hold_time = np.maximum(T_guard, T)
-                yield self.env.timeout(hold_time)
+            # Jumps straight over closed hours
+            t = get_next_arrival(self.env.now)
+            if t == math.inf:
+                return
+            yield self.env.timeout(t - self.env.now)
+
+            # Schedule plane
+            if is_delayed():
+                delay = get_delayed_time()
             else:
-                yield self.env.timeout(1)
+                delay = 0
 
-class PlowTruck:
-    def __init__(self, env, runways, deployed):
-        self.env = env
-        self.runways = runways
-        self.deployed = deployed/3600
-
-        env.process(self.plow())
-
-    def plow(self):
-        with runways.request(priority=0) as req:
-            yield req
-            yield self.env.timeout(T_PLOW)
-
-class PlowTruckGenerator:
-    def __init__(self, env, runways):
-        self.env = env
-        self.runways = runways
-        self.trucks = []
-        env.process(self.generate())
-    
-    def generate(self):
-        while True:
-            # Snows for a certain amount of time
-            yield self.env.timeout(get_snow_time())
-
-            """
-                In order to close all runways after snowing, we schedule NUM_RUNWAYS amount of trucks;
-                however, only NUM_PLOW_TRUCKS trucks are allowed to operate at a time in order to uphold 
-                the contraints. This is achieved by increase or decrease the plowing time depending on the 
-                runway-to-plowtruck ratio (NUM_RUNWAYS/NUM_PLOW_TRUCKS). E.g. if we have one plow truck and three runways, we have to 'deploy'
-                three plow trucks to stop all plane traffic on the runways, but we have to increase the plowing
-                time my a magnitude of 3 to simulate only one plow truck operating.  
-            """
-            for i in range(NUM_RUNWAYS):
-                self.trucks.append(PlowTruck(env, runways, self.env.now))
-
-            # Skies are clear for a certain amount of time
-            yield self.env.timeout(get_clear_time())
+            Plane(self.env, t, delay, self.runways, self.deicing_trucks, self.stats, self.records)
 
 class Weather:
     def __init__(self, env, runways):
         self.env = env
         self.runways = runways
-        self.trucks = []
         env.process(self.run())
 
     def run(self):
         while True: 
-            fill = self.env.process(self.fill())
-            snow = self.env.process(self.snow(fill))
             """
                 Snows for a certain amount of time. 
                 Runways may be filled multiple times per snowing.
             """
-            yield snow & fill
+            snow_end = self.env.now + get_snow_time()
+            while True:
+                fill = self.env.now + get_runway_fill_time()
+                if fill >= snow_end:
+                    break
+                yield self.env.timeout(fill - self.env.now)
+                self.runways.snowed_in()
+            yield self.env.timeout(snow_end - self.env.now)
 
             # Skies are clear for a certain amount of time
             yield self.env.timeout(get_clear_time())
 
-    def fill(self):
-        while True:
-            try:
-                yield self.env.timeout(get_runway_fill_time())
-
-                for i in range(NUM_RUNWAYS):
-                    self.trucks.append(PlowTruck(env, runways, self.env.now))
-            except simpy.Interrupt:
-                pass
-
-
-    def snow(self, fill):
-        yield self.env.timeout(get_snow_time())
-        fill.interrupt()
-
-
-
-
-
-if __name__ == "__main__":
+def simulate(keep_planes=False):
     env = simpy.Environment()
 
-    runways = simpy.PriorityResource(env, capacity=NUM_RUNWAYS)
+    runways = Runways(env, NUM_RUNWAYS, NUM_PLOW_TRUCKS, T_PLOW)
     deicing_trucks = simpy.PriorityResource(env, capacity=NUM_DEICING_TRUCKS)
-    plane_gen = PlaneGenerator(env, runways, deicing_trucks)
-    plow_gen = Weather(env, runways)#PlowTruckGenerator(env, runways)
+    plane_gen = PlaneGenerator(env, runways, deicing_trucks, keep_planes)
+    Weather(env, runways)
 
     env.run(until=SIM_TIME)
 
-    means = []
-
-    prev_hour = FIRST_PLANE
-    inter_arrival = []
-
-    plane_gen.planes.sort(key=lambda x:x.arrival_time)
-
-    time = []
-
-    for i in range(len(plane_gen.planes) - 1):
-        calc_time = (plane_gen.planes[i+1].arrival_time+plane_gen.planes[i].arrival_time)/2/3600
-
-        if calc_time < 24:
-            time.append((plane_gen.planes[i+1].arrival_time+plane_gen.planes[i].arrival_time)/2/3600)
-            inter_arrival.append([plane_gen.planes[i+1].arrival_time - plane_gen.planes[i].arrival_time])
-
-    landing_means = take_means(plane_gen.planes, "landing")
-    takeoff_means = take_means(plane_gen.planes, "takeoff")
-    deicing_means = take_means(plane_gen.planes, "deicing")
+    return plane_gen, runways
+
+def replication(seed):
+    # One independent airport day on its own random stream
+    sampling.seed(seed)
+    plane_gen, _ = simulate()
+    return plane_gen.stats.mean()
+
+def plot_replications(figures, means, half):
+    plt = figures.pyplot()
+    hours = np.arange(24)
+    for k, style in enumerate(["y", "r", "b--"]):
+        plt.plot(hours, means[k], style)
+    for k, colour in enumerate(["y", "r", "b"]):
+        plt.fill_between(hours, means[k] - half[k], means[k] + half[k], color=colour, alpha=0.2)
+    plt.legend(['Landing', 'take-off', "deicing"])
+    plt.xlabel('Hour of day')
+    plt.ylabel('Queue time (seconds)')
+    plt.title('Mean landing, take-off and deicing queue times', fontsize=16)
 
-    print("{} plow trucks deployed".format(len(plow_gen.trucks)))
-    i = 0
-    for truck in plow_gen.trucks:
-        print("Truck {} deployed at hour {}".format(i, truck.deployed))
-        i += 1
+    return figures.done("2c_replications")
 
-    plt.plot([i for i in range(len(landing_means))], landing_means, "y")
-    plt.plot([i for i in range(len(takeoff_means))], takeoff_means, "r")
-    plt.plot([i for i in range(len(deicing_means))], deicing_means, "b--")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Airport with deicing and snow plowing")
+    parser.add_argument("-n", "--replications", type=int, default=1,
+                        help="independent days to simulate (default: 1 sample path)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="worker processes for replications (default: all cores)")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="master seed")
+    parser.add_argument("--keep-planes", action="store_true",
+                        help="keep per-plane records and print hourly queue time percentiles")
+    plotting.add_arguments(parser)
+    args = parser.parse_args()
+    figures = plotting.Figures.from_args(args)
+    if args.keep_planes and args.replications > 1:
+        parser.error("--keep-planes is for single runs")
+
+    if args.replications > 1:
+        results = replicate.run(replication, args.replications, args.seed, args.workers)
+        means, half, _ = replicate.confidence_interval(results)
+        for hour in range(24):
+            if not np.isnan(means[0][hour]):
+                print("{:2d}: landing {:7.1f} ± {:5.1f}  take-off {:7.1f} ± {:5.1f}  deicing {:7.1f} ± {:5.1f}".format(
+                    hour, means[0][hour], half[0][hour], means[1][hour], half[1][hour], means[2][hour], half[2][hour]))
+        if figures.wanted:
+            plot_replications(figures, means, half)
+        sys.exit()
+
+    if args.seed is not None:
+        sampling.seed(args.seed)
+    plane_gen, runways = simulate(args.keep_planes)
+
+    landing_means, takeoff_means, deicing_means = plane_gen.stats.mean()
+
+    print("{} runway closures, mean closure {:.1f} minutes".format(runways.closures, runways.closed.mean/60))
+    if plane_gen.records is not None:
+        pct = queue_stats(plane_gen.records)["pct"]
+        print("Queue time p50/p90/p99 in seconds by hour of arrival:")
+        for hour in np.flatnonzero(~np.isnan(pct[0, 0])):
+            print("{:2d}: landing {:6.0f} /{:6.0f} /{:6.0f}  take-off {:6.0f} /{:6.0f} /{:6.0f}  "
+                  "deicing {:6.0f} /{:6.0f} /{:6.0f}".format(hour, *pct[:, :, hour].ravel()))
+
+    if not figures.wanted:
+        sys.exit()
+
+    plt = figures.pyplot()
+    plt.plot(range(24), landing_means, "y")
+    plt.plot(range(24), takeoff_means, "r")
+    plt.plot(range(24), deicing_means, "b--")
     plt.legend(['Landing', 'take-off', "deicing"])
     plt.xlabel('Hour of day')
     plt.ylabel('Queue time (seconds)')
     plt.title('Mean landing, take-off and deicing queue times', fontsize=16)
 
-    plt.show()
\ No newline at end of file
+    figures.done("2c_default")
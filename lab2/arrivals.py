@@ -0,0 +1,132 @@
+import math
+from collections import namedtuple
+import numpy as np
+
+Schedule = namedtuple("Schedule", ["scheduled", "delay", "inter_arrival"])
+
+# Arrivals generated per block of segments, bounds the temporary arrays
+BLOCK = 1 << 20
+
+def _fill(starts, ends, rates, guard, rng):
+    """
+        Candidate arrival times for each open segment, as one flat array
+        ordered by segment, plus the raw (unguarded) gap before each time and
+        the per-segment counts. Within a band the gaps are iid max(Exp/rate,
+        guard), so the times are a cumulative sum starting at start +
+        Exp/rate. The draws run past the segment's end, far enough that they
+        still do if the first arrival is moved back to the start, so that
+        generate() can place the first arrival anywhere in the segment and
+        find the draw that crosses its end. Segments whose draws don't reach
+        that far are drawn again with twice as many variates.
+    """
+    mean_gap = guard + np.exp(-rates*guard)/rates
+    expected = (ends - starts)/mean_gap
+    n = np.ceil(expected + 6*np.sqrt(expected) + 8).astype(np.int64)
+    times, raws, counts = [], [], []
+    todo = np.arange(len(starts))
+    while len(todo):
+        m = n[todo]
+        first = np.concatenate(([0], np.cumsum(m)[:-1]))
+        raw = rng.standard_exponential(m.sum())
+        raw *= np.repeat(1/rates[todo], m)
+        gaps = np.maximum(raw, guard)
+        gaps[first] = raw[first]
+        t = np.cumsum(gaps)
+        t += np.repeat(starts[todo] - (t[first] - raw[first]), m)
+
+        covered = t[first + m - 1] - raw[first] >= ends[todo]
+        keep = np.repeat(covered, m)
+        times.append(t[keep])
+        raws.append(raw[keep])
+        c = np.zeros(len(starts), dtype=np.int64)
+        c[todo[covered]] = m[covered]
+        counts.append(c)
+        todo = todo[~covered]
+        n[todo] *= 2
+
+    if len(times) == 1:
+        return times[0], raws[0], counts[0]
+    # Some segments needed a second round; put every segment's times back in
+    # segment order
+    seg = np.concatenate([np.repeat(np.arange(len(starts)), c) for c in counts])
+    order = np.argsort(seg, kind="stable")
+    return np.concatenate(times)[order], np.concatenate(raws)[order], np.sum(counts, axis=0)
+
+def generate(table, t0, t1, guard=0, p_delay=0, mu_delay=0, rng=None):
+    """
+        Closed-form version of the 2a PlaneGenerator: scheduled arrival times in
+        [t0, t1) of the piecewise Poisson schedule `table` with at least `guard`
+        seconds between planes, plus each plane's delay (Gamma(3, mu_delay)
+        with probability p_delay) and the time to the next scheduled plane (NaN
+        for the last plane before the airport closes or the horizon ends).
+        No event loop is involved.
+    """
+    rng = rng or np.random.default_rng()
+    starts, ends, rates = table.segments(t0, t1)
+
+    # Blocks of segments keep the temporaries bounded for very long horizons
+    edges = [0]
+    if len(starts):
+        expected = np.cumsum((ends - starts)*rates)
+        cuts = np.searchsorted(expected, np.arange(BLOCK, expected[-1], BLOCK), side="right")
+        edges = [0] + sorted(set(cuts[(cuts > 0) & (cuts < len(starts))].tolist())) + [len(starts)]
+    times, raws, counts = [np.empty(0)], [np.empty(0)], [np.zeros(0, dtype=np.int64)]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        t, r, c = _fill(starts[lo:hi], ends[lo:hi], rates[lo:hi], guard, rng)
+        times.append(t)
+        raws.append(r)
+        counts.append(c)
+    t = np.concatenate(times)
+    raw = np.concatenate(raws)
+    counts = np.concatenate(counts)
+    offset = np.cumsum(counts) - counts
+    seg = np.repeat(np.arange(len(counts)), counts)
+    kept = np.bincount(seg[t < ends[seg]], minlength=len(counts))
+
+    # Band boundaries, as the sequential generator crosses them: the draw that
+    # crosses a segment's end carries on. A short draw that only crosses
+    # because the guard stretched it puts the next plane at exactly prev +
+    # guard, in whatever open band that is; a long one continues at the next
+    # band's rate, which by memorylessness is the segment's own first draw,
+    # pushed back to prev + guard if it comes too soon. Only a scalar check
+    # runs per segment; the shifts are applied in one go afterwards.
+    kept = kept.tolist()
+    firsts = t[offset].tolist() if len(t) else []
+    shift = [0.0]*len(counts)
+    pinned = {}
+    prev = -math.inf
+    carry = False
+    for k, (a, c, start, end) in enumerate(zip(offset.tolist(), counts.tolist(), starts.tolist(), ends.tolist())):
+        target = prev + guard
+        if (carry and target >= start) or firsts[k] < target:
+            pinned[a] = target
+            shift[k] = target - firsts[k]
+            kept[k] = int(np.searchsorted(t[a:a + c], end - shift[k]))
+        if not kept[k]:
+            carry = a in pinned
+            continue
+        j = a + kept[k]
+        prev = float(t[j - 1]) + shift[k]
+        carry = prev + float(raw[j]) < end
+
+    scheduled = t + np.repeat(shift, counts)
+    # Pinned planes at exactly prev + guard, without the shift's rounding
+    scheduled[list(pinned)] = list(pinned.values())
+    keep = np.arange(len(t)) - np.repeat(offset, counts) < np.repeat(kept, counts)
+    scheduled = scheduled[keep]
+
+    # No successor for the last plane of an open stretch (the next segment
+    # doesn't start where this one ends) or of the horizon
+    stretch = np.cumsum(np.append(True, starts[1:] != ends[:-1])) if len(starts) else np.zeros(0, dtype=np.int64)
+    stretch = np.repeat(stretch, kept)
+    inter_arrival = np.empty(len(scheduled))
+    inter_arrival[:-1] = np.diff(scheduled)
+    inter_arrival[:-1][stretch[1:] != stretch[:-1]] = np.nan
+    if len(scheduled):
+        inter_arrival[-1] = np.nan
+
+    delay = np.zeros(len(scheduled))
+    delayed = rng.random(len(scheduled)) < p_delay
+    delay[delayed] = mu_delay*rng.standard_gamma(3, np.count_nonzero(delayed))
+
+    return Schedule(scheduled, delay, inter_arrival)
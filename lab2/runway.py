@@ -0,0 +1,42 @@
+import simpy
+from simlib.stats import Welford
+
+class Runways(simpy.PriorityResource):
+    """
+        The runways plus the plow trucks that clear them. Planes request
+        runways as from any PriorityResource. When snow fills the runways,
+        snowed_in() starts a single closure process that takes all runways at
+        once (priority 0 goes ahead of every waiting plane) and then has the
+        trucks plow them; each runway reopens as soon as it is plowed. There
+        is no per-runway snow state: a runway is snowed in exactly while the
+        closure process holds it.
+    """
+    def __init__(self, env, capacity, plow_trucks, t_plow):
+        super().__init__(env, capacity)
+        self.env = env
+        self.trucks = simpy.Resource(env, plow_trucks)
+        self.t_plow = t_plow
+        self.closures = 0
+        self.closed = Welford()
+
+    def snowed_in(self):
+        return self.env.process(self.clear())
+
+    def clear(self):
+        start = self.env.now
+        self.closures += 1
+        held = [self.request(priority=0) for _ in range(self.capacity)]
+        yield self.env.all_of(held)
+
+        # Every truck plows one runway at a time, so the runways are cleared in
+        # waves of as many runways as there are trucks
+        crew = [self.trucks.request() for _ in range(min(self.trucks.capacity, self.capacity))]
+        yield self.env.all_of(crew)
+        for first in range(0, self.capacity, len(crew)):
+            yield self.env.timeout(self.t_plow)
+            for i in range(first, min(first + len(crew), self.capacity)):
+                self.release(held[i])
+        for req in crew:
+            self.trucks.release(req)
+
+        self.closed.add(self.env.now - start)
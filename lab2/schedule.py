@@ -0,0 +1,135 @@
+import math
+import numpy as np
+from bisect import bisect_right
+
+HOUR = 3600
+DAY = 24*HOUR
+
+class RateTable:
+    """
+        Piecewise-constant arrival rate. Band i covers [starts[i], starts[i+1])
+        and has rates[i] arrivals per second; the last band runs to the end of
+        the period. With a period the table repeats (e.g. one airport day),
+        without one the last band lasts forever.
+    """
+    def __init__(self, starts, rates, period=None):
+        if len(starts) != len(rates) or starts[0] != 0:
+            raise ValueError("need one rate per band and the first band starting at 0")
+        if list(starts) != sorted(starts):
+            raise ValueError("band starts must be increasing")
+        if period is not None and starts[-1] >= period:
+            raise ValueError("band starts must lie inside the period")
+        self.starts = list(starts)
+        self.rates = list(rates)
+        self.period = period
+        self.open = any(r > 0 for r in self.rates)
+
+    @classmethod
+    def per_hour(cls, hours, rates, period=DAY):
+        # Bands given in hours of day and arrivals per hour
+        return cls([h*HOUR for h in hours], [r/HOUR for r in rates], period)
+
+    @classmethod
+    def from_means(cls, hours, means, period=DAY):
+        # Bands given in hours of day and mean inter-arrival times in seconds,
+        # None for closed
+        return cls([h*HOUR for h in hours], [0 if m is None else 1/m for m in means], period)
+
+    def _locate(self, t):
+        # Band index containing t and the start time of t's period
+        if self.period is None:
+            return bisect_right(self.starts, t) - 1, 0
+        base = t - t % self.period
+        return bisect_right(self.starts, t - base) - 1, base
+
+    def _end(self, i):
+        if i + 1 < len(self.starts):
+            return self.starts[i + 1]
+        return math.inf if self.period is None else self.period
+
+    def rate(self, t):
+        i, _ = self._locate(t)
+        return self.rates[i]
+
+    def advance(self, t, work):
+        """
+            Time at which the integrated rate from t reaches `work`, i.e. the next
+            arrival of the non-homogeneous Poisson process when `work` is a unit
+            exponential. Closed bands are skipped at no cost and a draw that runs
+            past a band boundary continues at the next band's rate. Returns
+            math.inf if the table never opens again.
+        """
+        if not self.open:
+            return math.inf
+        i, base = self._locate(t)
+        while True:
+            end = base + self._end(i)
+            r = self.rates[i]
+            if r > 0:
+                if t + work/r <= end:
+                    return t + work/r
+                work -= (end - t)*r
+            elif end == math.inf:
+                return math.inf
+            t = end
+            i += 1
+            if i == len(self.starts):
+                i = 0
+                base += self.period
+
+    def open_until(self, t):
+        # End of the open stretch containing t (t itself if closed)
+        i, base = self._locate(t)
+        start = t
+        while self.rates[i] > 0:
+            t = base + self._end(i)
+            if t == math.inf or (self.period and t - start >= self.period):
+                return math.inf
+            i += 1
+            if i == len(self.starts):
+                i = 0
+                base += self.period
+        return t
+
+    def next_arrival(self, t, draw, guard=0):
+        """
+            Next arrival after t with at least `guard` seconds spacing. `draw()`
+            returns unit exponentials. If the guard pushes an arrival into a
+            closed band it is redrawn from there, so no arrival falls in closed
+            hours.
+        """
+        while True:
+            nxt = self.advance(t, draw())
+            if nxt == math.inf:
+                return nxt
+            nxt = max(nxt, t + guard)
+            if self.rate(nxt) > 0:
+                return nxt
+            t = nxt
+
+    def segments(self, t0, t1):
+        """
+            The open bands overlapping [t0, t1) as arrays (starts, ends, rates),
+            clipped to the interval. Periodic tables are unrolled one period at a
+            time with NumPy, so a year of days costs no Python loop per band.
+        """
+        starts = np.array(self.starts, dtype=float)
+        ends = np.array([self._end(i) for i in range(len(self.starts))], dtype=float)
+        rates = np.array(self.rates, dtype=float)
+        open_ = rates > 0
+        starts, ends, rates = starts[open_], ends[open_], rates[open_]
+        if self.period is not None:
+            first = math.floor(t0/self.period)
+            last = math.ceil(t1/self.period)
+            base = np.repeat(np.arange(first, last)*float(self.period), len(starts))
+            starts = np.tile(starts, last - first) + base
+            ends = np.tile(ends, last - first) + base
+            rates = np.tile(rates, last - first)
+        keep = (ends > t0) & (starts < t1)
+        return np.maximum(starts[keep], t0), np.minimum(ends[keep], t1), rates[keep]
+
+# 2c: planes per hour in each band
+AIRPORT_2C = RateTable.per_hour([0, 5, 8, 11, 15, 20], [0, 120, 30, 150, 30, 120])
+
+# 2a/2b: mean inter-arrival time in seconds in each band
+AIRPORT_2A = RateTable.from_means([0, 5, 8, 11, 15, 20], [None, 120, 30, 150, 30, 120])
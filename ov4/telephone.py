@@ -1,5 +1,17 @@
+import math
 import numpy as np
 import simpy 
+import argparse
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from simlib import sampling
+from simlib.records import RecordStore
+from simlib.deadline import race
+from simlib.sequential import Control
+from simlib.steady import SteadyState
+from simlib.trace import TraceWriter, TraceReader
+import vectorized
 
 # Seconds
 NEXT_CALL = 30*60
@@ -10,22 +22,37 @@ AVG_VARIABLE_CONNECTION = 3
 AVG_CONVERSATION_TIME = 3*60
 
 SIM_TIME = 30*24*60*60 # 30 days in seconds
+KEEP_RECORDS = False # keep one record per call attempt
+CHECK_INTERVAL = 60*60 # between precision checks with --precision
+
+_exponential = sampling.exponential()
+_uniform = sampling.uniform()
 
 def time_to_next_call():
-    return np.random.exponential(NEXT_CALL)
+    return NEXT_CALL*_exponential()
 
 def time_for_connection():
-    return np.random.exponential(AVG_VARIABLE_CONNECTION)
+    return AVG_VARIABLE_CONNECTION*_exponential()
 
 def time_for_conv():
-    return np.random.exponential(AVG_CONVERSATION_TIME)
+    return AVG_CONVERSATION_TIME*_exponential()
+
+def call_records():
+    return RecordStore(subscriber=np.int32, start=float, lost=bool, duration=float)
 
 class Subscriber: 
-    def __init__(self, env, name):
+    __slots__ = ("env", "name", "num", "records", "stats", "trace", "process",
+                 "calls", "lost_calls", "total_duration", "attempts")
+
+    def __init__(self, env, name, num=0, records=None, stats=None, trace=None, live=True):
         self.env = env
         self.name = name
-        self.interrupted = False
-        self.process = env.process(self.inititate_call())
+        self.num = num
+        self.records = records
+        self.stats = stats
+        self.trace = trace
+        # Without live the calls come from replay_calls() instead
+        self.process = env.process(self.inititate_call()) if live else None
         self.calls = 0 
         self.lost_calls = 0
         self.total_duration = 0
@@ -36,44 +63,254 @@ class Subscriber:
         while True:
             yield self.env.timeout(time_to_next_call())
             
-            timer = Timer(env, self)
+            start = self.env.now
             conn_time = FIXED_CONNECTION_TIME + time_for_connection()
-            try:
-                yield self.env.timeout(conn_time)
-                timer.process.interrupt()
-                t = time_for_conv()
+            talk = None
+            if self.trace is not None:
+                # A trace row needs the whole call up front
+                talk = time_for_conv()
+                self.trace.append(time=start, subscriber=self.num, connect=conn_time, conversation=talk)
+            # The call is lost if connecting takes longer than MAX_CONNECTION_TIME
+            if (yield from race(self.env, conn_time, MAX_CONNECTION_TIME)):
+                t = time_for_conv() if talk is None else talk
                 self.calls += 1
                 self.total_duration += t
+                if self.records is not None:
+                    self.records.append(subscriber=self.num, start=start, duration=t)
+                if self.stats is not None:
+                    self.stats.add(start, lost=0.0, duration=t)
                 yield self.env.timeout(t)
-            except simpy.Interrupt:
+            else:
                 self.lost_calls += 1
+                if self.records is not None:
+                    self.records.append(subscriber=self.num, start=start, lost=True)
+                if self.stats is not None:
+                    self.stats.add(start, lost=1.0)
             
             self.attempts += 1
             yield self.env.timeout(DISCONNECT_TIME)
 
 
-class Timer:
-    def __init__(self, env, sub):
+def call_trace(path):
+    return TraceWriter(path, time=float, subscriber=np.int32, connect=float, conversation=float)
+
+def replay_calls(env, subs, reader):
+    """
+        Plays the call attempts of a recorded trace (time, subscriber, connect
+        and conversation time, in time order) against the subscribers, one
+        chunk of the trace in memory at a time. The outcome of an attempt is
+        known from its row, so there is no process per call; unlike the live
+        model an attempt counts as soon as it starts.
+    """
+    for start, num, conn_time, t in reader.rows("time", "subscriber", "connect", "conversation"):
+        yield env.timeout(start - env.now)
+        if num >= len(subs):
+            raise ValueError("trace has calls of subscriber {}, but there are only {}".format(num, len(subs)))
+        sub = subs[num]
+        sub.attempts += 1
+        if conn_time <= MAX_CONNECTION_TIME:
+            sub.calls += 1
+            sub.total_duration += t
+            if sub.records is not None:
+                sub.records.append(subscriber=num, start=start, duration=t)
+            if sub.stats is not None:
+                sub.stats.add(start, lost=0.0, duration=t)
+        else:
+            sub.lost_calls += 1
+            if sub.records is not None:
+                sub.records.append(subscriber=num, start=start, lost=True)
+            if sub.stats is not None:
+                sub.stats.add(start, lost=1.0)
+
+
+class Exchange:
+    """
+        Subscribers sharing an exchange with a limited number of trunk lines.
+        A call that finds every trunk busy is blocked right away (Erlang-B
+        style loss), otherwise it holds a trunk while connecting and talking.
+
+        Instead of a process per subscriber there is one arrival process for
+        the whole population: candidates arrive at the rate of everyone being
+        idle, n/NEXT_CALL, and each picks a random subscriber. Candidates that
+        pick a busy subscriber are thinned away, which leaves exactly the
+        superposed rate of the idle subscribers. Only calls in progress (at
+        most one per trunk) have a process of their own.
+    """
+    def __init__(self, env, n, trunks):
         self.env = env
-        self.sub = sub
-        self.process = env.process(self.timing())
+        self.n = n
+        self.trunks = simpy.Resource(env, capacity=trunks)
+        self.busy = bytearray(n)
+        self.attempts = 0
+        self.blocked = 0
+        self.lost_calls = 0
+        self.calls = 0
+        self.total_duration = 0
+        env.process(self.arrivals())
+
+    def arrivals(self):
+        while True:
+            yield self.env.timeout(time_to_next_call()/self.n)
+            sub = int(self.n*_uniform())
+            if self.busy[sub]:
+                continue
+
+            self.attempts += 1
+            if self.trunks.count == self.trunks.capacity:
+                self.blocked += 1
+                continue
+            self.busy[sub] = 1
+            self.env.process(self.call(sub))
+
+    def call(self, sub):
+        with self.trunks.request() as req:
+            yield req
+            conn_time = FIXED_CONNECTION_TIME + time_for_connection()
+            if (yield from race(self.env, conn_time, MAX_CONNECTION_TIME)):
+                t = time_for_conv()
+                self.calls += 1
+                self.total_duration += t
+                yield self.env.timeout(t)
+            else:
+                self.lost_calls += 1
+
+        yield self.env.timeout(DISCONNECT_TIME)
+        self.busy[sub] = 0
+
+def source_traffic():
+    # Mean trunk holding time over mean idle time of one subscriber. A call
+    # that takes longer than MAX_CONNECTION_TIME to connect gives up there
+    # and has no conversation, so both parts are truncated.
+    lost = math.exp(-(MAX_CONNECTION_TIME - FIXED_CONNECTION_TIME)/AVG_VARIABLE_CONNECTION)
+    holding = FIXED_CONNECTION_TIME + (1 - lost)*(AVG_VARIABLE_CONNECTION + AVG_CONVERSATION_TIME)
+    return holding/NEXT_CALL
+
+def engset(n, trunks):
+    # Call congestion for n subscribers that only call while idle, which is
+    # what the exchange simulates. It only approaches Erlang-B as n grows
+    # with the total traffic held fixed, not at a fixed load per subscriber.
+    a = source_traffic()
+    if trunks >= n:
+        return 0.0
+    terms = [math.lgamma(n) - math.lgamma(k + 1) - math.lgamma(n - k) + k*math.log(a) for k in range(trunks + 1)]
+    top = max(terms)
+    return math.exp(terms[-1] - top)/sum(math.exp(t - top) for t in terms)
+
+def offered_traffic(n):
+    # Erlangs offered by n subscribers with no blocking: each one is busy a
+    # fraction a/(1 + a) of the time, as a busy subscriber doesn't call
+    a = source_traffic()
+    return n*a/(1 + a)
+
+def simulate_exchange(n, trunks, sim_time=SIM_TIME):
+    env = simpy.Environment()
+    exchange = Exchange(env, n, trunks)
+    env.run(until=sim_time)
+    return exchange
+
+def simulate(n=20, sim_time=SIM_TIME, precision=None, max_wall=None, steady=False, record=None, replay=None,
+             keep_records=KEEP_RECORDS):
+    """
+        Runs for sim_time, or with a precision until the lost-call ratio and
+        the mean call duration are both known to that relative precision, for
+        at most sim_time (see simlib/sequential.py). With steady=True the two metrics are recorded
+        for a warm-up corrected estimate (simlib/steady.py). record and
+        replay are trace directories (see simlib/trace.py) to write the call
+        attempts to or to take them from. Returns the counters, the Control
+        or SteadyState (None if neither is used) and with keep_records the
+        per-attempt RecordStore (else None).
+    """
+    env = simpy.Environment()
+
+    records = call_records() if keep_records else None
+    stats = None
+    if precision is not None:
+        stats = Control(env, ["lost", "duration"], precision, CHECK_INTERVAL, max_time=sim_time, max_wall=max_wall)
+    elif steady:
+        stats = SteadyState(["lost", "duration"])
+    trace = call_trace(record) if record is not None else None
+    subs = [Subscriber(env, "Subscriber {}".format(i), i, records, stats, trace, live=replay is None)
+            for i in range(n)]
+    if replay is not None:
+        env.process(replay_calls(env, subs, TraceReader(replay)))
 
-    def timing(self):
-        try:
-            yield self.env.timeout(MAX_CONNECTION_TIME)
-            self.sub.process.interrupt()
-        except simpy.Interrupt:
-            pass
+    try:
+        env.run(until=stats.done if precision is not None else sim_time)
+    finally:
+        # Whatever was recorded stays readable, even if the run is cut short
+        if trace is not None:
+            trace.close()
 
+    return vectorized.Counters(np.array([sub.calls for sub in subs]), np.array([sub.lost_calls for sub in subs]),
+                               np.array([sub.attempts for sub in subs]), np.array([sub.total_duration for sub in subs])), stats, records
 
-env = simpy.Environment()
+def simulate_numpy(n=20, sim_time=SIM_TIME):
+    # All subscribers as arrays, see vectorized.py
+    return vectorized.simulate(n, sim_time, NEXT_CALL, MAX_CONNECTION_TIME, FIXED_CONNECTION_TIME,
+                               DISCONNECT_TIME, AVG_VARIABLE_CONNECTION, AVG_CONVERSATION_TIME,
+                               sampling.default_rng())
 
-subs = [Subscriber(env, "Subscriber {}".format(i)) for i in range(20)]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telephone subscribers")
+    parser.add_argument("-n", "--subscribers", type=int, default=20, help="number of subscribers")
+    parser.add_argument("-e", "--engine", choices=["simpy", "numpy"], default="simpy",
+                        help="process per subscriber or the vectorized engine")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="seed")
+    parser.add_argument("-x", "--trunks", type=int, nargs="+", default=None, metavar="N",
+                        help="shared exchange with N trunk lines (several N give a blocking curve)")
+    parser.add_argument("-p", "--precision", type=float, default=None,
+                        help="run until the loss ratio and mean duration are known to this relative CI half-width "
+                             "(e.g. 0.05), for at most --sim-time")
+    parser.add_argument("--max-wall", type=float, default=300, help="wall time cap in seconds with --precision")
+    parser.add_argument("--steady", action="store_true",
+                        help="also report steady-state estimates with the warm-up cut off (MSER-5)")
+    parser.add_argument("-t", "--sim-time", type=float, default=SIM_TIME, help="simulated seconds (default: 30 days)")
+    parser.add_argument("--record", default=None, metavar="DIR", help="record the call attempts as a trace")
+    parser.add_argument("--replay", default=None, metavar="DIR",
+                        help="take the call attempts from a recorded trace (-n must cover its subscribers)")
+    parser.add_argument("--keep-records", action="store_true",
+                        help="keep one record per call attempt and report call duration percentiles")
+    args = parser.parse_args()
+    if (args.precision is not None or args.steady or args.record or args.replay or args.keep_records) \
+            and args.engine != "simpy":
+        parser.error("--precision, --steady, --record, --replay and --keep-records need the simpy engine")
+    if args.precision is not None and args.steady:
+        parser.error("--precision and --steady are alternatives")
+    if args.record and args.replay:
+        parser.error("--record and --replay are alternatives, a replayed run records nothing")
 
-env.run(until=SIM_TIME)
+    if args.seed is not None:
+        sampling.seed(args.seed)
 
-for sub in subs:
-    print("{} had {}/{} lost calls. Mean duration for calls: {:.2f} seconds".format(sub.name, sub.lost_calls, sub.attempts, sub.total_duration/sub.calls))
-    
+    if args.trunks:
+        traffic = offered_traffic(args.subscribers)
+        print("{} subscribers offer about {:.1f} Erlang".format(args.subscribers, traffic))
+        for trunks in args.trunks:
+            ex = simulate_exchange(args.subscribers, trunks, args.sim_time)
+            print("{:5d} trunks: {:.4f} blocked ({}/{}), Engset {:.4f}, {:.3f}% lost while connecting".format(
+                trunks, ex.blocked/ex.attempts, ex.blocked, ex.attempts, engset(args.subscribers, trunks),
+                100*ex.lost_calls/max(1, ex.attempts - ex.blocked)))
+        sys.exit()
 
+    stats = records = None
+    if args.engine == "numpy":
+        result = simulate_numpy(args.subscribers, args.sim_time)
+    else:
+        result, stats, records = simulate(args.subscribers, args.sim_time, args.precision, args.max_wall,
+                                          args.steady, args.record, args.replay, args.keep_records)
 
+    if args.subscribers <= 100:
+        for i in range(args.subscribers):
+            print("Subscriber {} had {}/{} lost calls. Mean duration for calls: {:.2f} seconds".format(
+                i, result.lost_calls[i], result.attempts[i], result.total_duration[i]/result.calls[i]))
+    print("In total {}/{} lost calls ({:.3f}%). Mean duration for calls: {:.2f} seconds".format(
+        result.lost_calls.sum(), result.attempts.sum(), 100*result.lost_calls.sum()/result.attempts.sum(),
+        result.total_duration.sum()/result.calls.sum()))
+    if records is not None:
+        duration = records.column("duration")
+        duration = duration[~records.column("lost") & ~np.isnan(duration)]
+        if len(duration):
+            print("Call duration p50/p90/p99 from {} records: {:.1f} / {:.1f} / {:.1f} seconds".format(
+                len(records), *np.percentile(duration, [50, 90, 99])))
+    if stats is not None:
+        print(stats.report())
@@ -0,0 +1,72 @@
+from collections import namedtuple
+import numpy as np
+
+Counters = namedtuple("Counters", ["calls", "lost_calls", "attempts", "total_duration"])
+
+# Draws per batch (subscribers x call cycles), bounds the temporary arrays
+BATCH = 1 << 20
+
+def simulate(n, sim_time, next_call, max_connection, fixed_connection, disconnect,
+             avg_variable_connection, avg_conversation, rng=None):
+    """
+        The ov4 subscriber model without an event loop. Subscribers never
+        interact, so each one is a renewal process of call cycles:
+
+            think ~ Exp(next_call)
+            connect = fixed_connection + Exp(avg_variable_connection)
+            lost if connect > max_connection, after max_connection
+            otherwise a conversation ~ Exp(avg_conversation)
+            disconnect
+
+        Cycles are drawn for blocks of subscribers at a time and laid out on the
+        time axis with a cumulative sum; whatever happens before sim_time is
+        counted exactly like the SimPy Subscriber counts it. Returns per-
+        subscriber arrays (calls, lost_calls, attempts, total_duration).
+    """
+    rng = rng or np.random.default_rng()
+    calls = np.zeros(n, dtype=np.int64)
+    lost_calls = np.zeros(n, dtype=np.int64)
+    attempts = np.zeros(n, dtype=np.int64)
+    total_duration = np.zeros(n)
+
+    # Enough cycles that nearly everyone finishes in the first batch
+    p_lost = np.exp(-(max_connection - fixed_connection)/avg_variable_connection)
+    mean_cycle = (next_call + disconnect + p_lost*max_connection
+                  + (1 - p_lost)*(fixed_connection + avg_variable_connection + avg_conversation))
+    expected = sim_time/mean_cycle
+    first = int(np.ceil(expected + 4*np.sqrt(expected) + 4))
+    block = max(1, BATCH//first)
+
+    for lo in range(0, n, block):
+        # Stragglers get fewer cycles per batch, but every block starts afresh
+        cycles = first
+        sub = np.arange(lo, min(lo + block, n))
+        t = np.zeros(len(sub))
+        while len(sub):
+            shape = (len(sub), cycles)
+            think = next_call*rng.standard_exponential(shape)
+            connect = fixed_connection + avg_variable_connection*rng.standard_exponential(shape)
+            conversation = avg_conversation*rng.standard_exponential(shape)
+            lost = connect > max_connection
+            busy = np.where(lost, max_connection, connect + conversation)
+
+            cycle = think + busy + disconnect
+            end = np.cumsum(cycle, axis=1)
+            end += t[:, None]
+            called = end - cycle + think
+
+            # Calls count when they connect, attempts when the conversation or
+            # the timer ends, just like in Subscriber.inititate_call
+            connected = ~lost & (called + connect < sim_time)
+            calls[sub] += connected.sum(axis=1)
+            total_duration[sub] += np.where(connected, conversation, 0).sum(axis=1)
+            finished = called + busy < sim_time
+            attempts[sub] += finished.sum(axis=1)
+            lost_calls[sub] += (lost & finished).sum(axis=1)
+
+            t = end[:, -1]
+            more = t < sim_time
+            sub, t = sub[more], t[more]
+            cycles = max(4, cycles//4)
+
+    return Counters(calls, lost_calls, attempts, total_duration)
@@ -0,0 +1,58 @@
+import heapq
+from collections import deque
+
+class DeadlineBuffer:
+    """
+        FIFO buffer whose items also carry a deadline. Items leave in arrival
+        order with popleft(), but purge(now) removes every item whose deadline
+        has passed in one go, wherever it sits in the queue. A heap orders the
+        items by deadline next to the FIFO deque; purged items are blanked in
+        place and skipped later, and the deque is compacted once most of it
+        is blank, so both memory and the cost per item stay bounded.
+    """
+    __slots__ = ("fifo", "heap", "seq", "dead", "size")
+
+    def __init__(self):
+        self.fifo = deque() # [deadline, item] entries, item None once purged
+        self.heap = []      # (deadline, seq, entry)
+        self.seq = 0
+        self.dead = 0
+        self.size = 0 # live items, same as len()
+
+    def __len__(self):
+        return self.size
+
+    def append(self, item, deadline):
+        entry = [deadline, item]
+        self.fifo.append(entry)
+        heapq.heappush(self.heap, (deadline, self.seq, entry))
+        self.seq += 1
+        self.size += 1
+
+    def popleft(self):
+        fifo = self.fifo
+        while True:
+            entry = fifo.popleft()
+            item = entry[1]
+            if item is not None:
+                # Served items are blanked too, their heap entry is skipped
+                entry[1] = None
+                self.size -= 1
+                return item
+            self.dead -= 1
+
+    def purge(self, now):
+        # Removes and returns the items with deadline < now, earliest first
+        heap = self.heap
+        expired = []
+        while heap and heap[0][0] < now:
+            entry = heapq.heappop(heap)[2]
+            if entry[1] is not None:
+                expired.append(entry[1])
+                entry[1] = None
+                self.dead += 1
+        self.size -= len(expired)
+        if self.dead > 32 and 2*self.dead > len(self.fifo):
+            self.fifo = deque(e for e in self.fifo if e[1] is not None)
+            self.dead = 0
+        return expired
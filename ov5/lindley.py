@@ -0,0 +1,190 @@
+import numpy as np
+from simlib import sampling
+from simlib.stats import LatencySketch
+from network import SIM_TIME, MAX_DELAY, NUM_SERVERS, Summary, RouterStats, default_config, service_shape
+from topology import Topology
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def _recursion(arrive, deadline, service):
+    """
+        Lindley recursion for one single-server FIFO router that purges a
+        waiting packet once its deadline has passed, at the next moment a
+        service would start (as Router.start does). arrive is sorted and
+        service[k] is the k-th service time started. Returns per packet the
+        service start and finish, NaN for dropped packets, and the drop time
+        of packets dropped on arrival at an idle router; packets dropped from
+        the queue get inf, see station().
+    """
+    n = len(arrive)
+    start = np.full(n, np.nan)
+    finish = np.full(n, np.nan)
+    dropped = np.full(n, np.nan)
+    m = 0
+    free = -np.inf
+    for i in range(n):
+        a, d = arrive[i], deadline[i]
+        if free <= a:
+            if d < a:
+                dropped[i] = a
+                continue
+            s = a
+        elif d < free:
+            dropped[i] = np.inf
+            continue
+        else:
+            s = free
+        free = s + service[m]
+        start[i] = s
+        finish[i] = free
+        m += 1
+    return start, finish, dropped
+
+if njit is not None:
+    _recursion = njit(cache=True)(_recursion)
+
+def station(arrive, deadline, service):
+    # _recursion plus the drop times of the packets purged from the queue:
+    # the first finish after both their arrival and their deadline, when the
+    # next service would start
+    if njit is None:
+        # Plain Python reads list items faster than array elements
+        start, finish, dropped = _recursion(arrive.tolist(), deadline.tolist(), service.tolist())
+    else:
+        start, finish, dropped = _recursion(arrive, deadline, service)
+    queued = dropped == np.inf
+    if queued.any():
+        ends = finish[~np.isnan(finish)]
+        dropped[queued] = ends[np.searchsorted(ends, np.maximum(arrive[queued], deadline[queued]), side="right")]
+    return start, finish, dropped
+
+def feed_forward(topology):
+    # Routers in an order where every hop of every flow goes forwards
+    succ = [set() for _ in range(topology.n)]
+    for f in range(len(topology.flow_src)):
+        path = topology.path(f)
+        for u, v in zip(path, path[1:]):
+            succ[u].add(v)
+    indegree = [0]*topology.n
+    for vs in succ:
+        for v in vs:
+            indegree[v] += 1
+    order = [u for u in range(topology.n) if not indegree[u]]
+    for u in order:
+        for v in succ[u]:
+            indegree[v] -= 1
+            if not indegree[v]:
+                order.append(v)
+    if len(order) < topology.n:
+        raise ValueError("the routes go round in a cycle, the Lindley recursion needs a feed-forward network")
+    return order
+
+def _arrivals(topology, s, sim_time):
+    # Generation times of source s before sim_time, drawn from the same stream
+    # as Generator, summed one by one like the timeouts are
+    mean = 1/topology.source_rate[s]
+    draw = sampling.exponential(stream="arrival/" + topology.names[s]).draw
+    times = [np.zeros(1)]
+    n = int(sim_time/mean + 6*np.sqrt(sim_time/mean)) + 16
+    while times[-1][-1] < sim_time:
+        times.append(np.cumsum(np.concatenate((times[-1][-1:], mean*draw(n))))[1:])
+    t = np.concatenate(times[1:])
+    return t[t < sim_time]
+
+def _flows(topology, s, count):
+    flows = np.array(topology.source_flows[s])
+    if len(flows) == 1:
+        return np.full(count, flows[0])
+    cum = np.array(topology.source_cum[s])
+    u = sampling.uniform(stream="routing/" + topology.names[s]).draw(count)
+    return flows[np.minimum(np.searchsorted(cum, u*cum[-1], side="right"), len(flows) - 1)]
+
+def _services(topology, u, count):
+    spec = topology.service[u]
+    shape = service_shape(spec)
+    if shape is None:
+        return np.full(count, float(spec["mean"]))
+    return spec["mean"]/shape*sampling.gamma(shape, stream="service/" + topology.names[u]).draw(count)
+
+def _router_stats(topology, u, sim_time, arrive, start, finish, dropped):
+    # The same per-router figures the event model integrates, from the
+    # per-packet times clipped to the horizon
+    leave = np.where(np.isnan(start), dropped, start)
+    inside = arrive < sim_time
+    queue_area = (np.minimum(leave[inside], sim_time) - arrive[inside]).sum()
+    began = start < sim_time
+    busy_area = (np.minimum(finish[began], sim_time) - start[began]).sum()
+    left = leave[leave < sim_time]
+    times = np.concatenate((arrive[inside], left))
+    delta = np.concatenate((np.ones(inside.sum(), dtype=np.int64), -np.ones(len(left), dtype=np.int64)))
+    # An arrival counts before a departure at the same moment, as in q_packet
+    order = np.lexsort((-delta, times))
+    max_queue = int(np.cumsum(delta[order]).max()) if len(times) else 0
+    return RouterStats(u, topology.names[u], int(np.count_nonzero(finish < sim_time)),
+                       int(np.count_nonzero(dropped < sim_time)), float(queue_area)/sim_time, max_queue,
+                       float(busy_area)/sim_time)
+
+def simulate(sim_time=SIM_TIME, topology=None, servers=NUM_SERVERS):
+    """
+        Event-free version of network.simulate for feed-forward networks of
+        single-server routers: every router is one pass of the Lindley
+        recursion over its packets' arrival times and pre-drawn service
+        times, in an order where upstream routers come first, and forwarding
+        is array arithmetic. The inputs come from the same per-source and
+        per-router streams as the event model, so after the same
+        sampling.seed() the two agree packet for packet (up to rounding in
+        the summed figures), which makes this both a fast estimator and a
+        cross-check. The recursion is compiled with Numba when it is
+        installed. Returns the Summary and the RouterStats in router order.
+    """
+    topology = topology or Topology(default_config(), servers)
+    if any(c != 1 for c in topology.servers):
+        raise ValueError("the Lindley recursion needs single-server routers")
+    order = feed_forward(topology)
+    n = topology.n
+    dests = np.array(topology.dests)
+    flow_row = np.array(topology.flow_row)
+    next_hop = np.frombuffer(topology.next_hop, dtype=np.int32)
+    hop_delay = np.frombuffer(topology.hop_delay, dtype=float)
+
+    # (arrival, timestamp, destination row) arrays waiting for each router
+    inbound = [[] for _ in range(n)]
+    generated = 0
+    for s in topology.sources:
+        t = _arrivals(topology, s, sim_time)
+        inbound[s].append((t, t, flow_row[_flows(topology, s, len(t))]))
+        generated += len(t)
+
+    e2e, drop_age = LatencySketch(), LatencySketch()
+    stats = [None]*n
+    for u in order:
+        if inbound[u]:
+            arrive, timestamp, row = (np.concatenate(a) for a in zip(*inbound[u]))
+        else:
+            arrive = timestamp = np.zeros(0)
+            row = np.zeros(0, dtype=flow_row.dtype)
+        inbound[u] = None
+        by_time = np.argsort(arrive, kind="stable")
+        arrive, timestamp, row = arrive[by_time], timestamp[by_time], row[by_time]
+        start, finish, dropped = station(arrive, timestamp + MAX_DELAY, _services(topology, u, len(arrive)))
+        stats[u] = _router_stats(topology, u, sim_time, arrive, start, finish, dropped)
+
+        lost = dropped < sim_time
+        drop_age.extend(dropped[lost] - timestamp[lost])
+        done = finish < sim_time
+        here = dests[row] == u
+        e2e.extend(finish[done & here] - timestamp[done & here])
+
+        on = done & ~here
+        i = row[on]*n + u
+        t = finish[on] + hop_delay[i]
+        keep = t < sim_time
+        nxt, t, ts, r = next_hop[i][keep], t[keep], timestamp[on][keep], row[on][keep]
+        for v in np.unique(nxt).tolist():
+            to_v = nxt == v
+            inbound[v].append((t[to_v], ts[to_v], r[to_v]))
+
+    return Summary(generated, sum(s.lost for s in stats), e2e, drop_age), stats
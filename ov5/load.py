@@ -0,0 +1,194 @@
+import argparse
+import copy
+import functools
+import json
+from collections import namedtuple
+import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from simlib import plotting, replicate, sampling, sweep
+import lindley
+import network
+from topology import Topology
+
+# Offered load: packets per second over the whole traffic matrix
+Load = namedtuple("Load", ["rate"])
+
+METRICS = {"loss": "loss", "p99": "e2e_p99"}
+# Default thresholds, fraction lost and seconds. Even an idle lab network
+# loses a percent or two to long services, so the targets sit well above that.
+TARGETS = {"loss": 0.1, "p99": 4.5}
+
+def scaled(config, rate):
+    # The network with every flow scaled so that the total rate is `rate`
+    config = copy.deepcopy(config)
+    factor = rate/sum(r for _, _, r in config["traffic"])
+    config["traffic"] = [[a, b, r*factor] for a, b, r in config["traffic"]]
+    return config
+
+def load_point(point, seed, config, servers=network.NUM_SERVERS, sim_time=network.SIM_TIME, replications=1,
+               fast=False):
+    # Rows per replication for one offered load, replication r on child r of seed
+    topology = Topology(scaled(config, point.rate), servers, network.default_config()["default"]["service"])
+    rows = []
+    for r, child in enumerate(seed.spawn(replications)):
+        sampling.seed(child)
+        if fast:
+            summary, _ = lindley.simulate(sim_time, topology)
+        else:
+            gen, _ = network.simulate(sim_time, topology=topology)
+            summary = network.summarize(gen)
+        rows.append({"replication": r, "generated": summary.generated, "lost": summary.lost,
+                     "throughput": summary.e2e.count/sim_time, "loss": summary.lost/max(summary.generated, 1),
+                     "e2e_mean": summary.e2e.mean, "e2e_p99": summary.e2e.quantile(0.99)})
+    return rows
+
+def curve(results, column):
+    # Rates in increasing order with the mean and CI half-width of a column
+    rates = sorted(results)
+    samples = np.array([[row[column] for row in results[rate]] for rate in rates]).T
+    mean, half, _ = replicate.confidence_interval(samples)
+    return np.array(rates), mean, half
+
+def knee(results, column, target):
+    """
+        The bracket (lo, hi) of evaluated rates around the first crossing of
+        `target` by the mean of `column`: hi is the lowest rate at or above
+        the target (NaN, e.g. no delivered packets, counts as above) and lo
+        the rate before it. lo is None if even the lowest rate crosses, hi is
+        None if none does.
+    """
+    rates, mean, _ = curve(results, column)
+    crossed = np.flatnonzero(~(mean < target))
+    if not len(crossed):
+        return rates[-1], None
+    i = crossed[0]
+    return (rates[i - 1] if i else None), rates[i]
+
+def next_rates(lo, hi, batch):
+    # batch new candidates: inside the bracket, or beyond it while it is open
+    if hi is None:
+        return np.linspace(lo, 2*lo, batch + 1)[1:]
+    if lo is None:
+        return np.linspace(hi/2, hi, batch + 1)[:-1]
+    return np.linspace(lo, hi, batch + 2)[1:-1]
+
+def resolved(results, column, target, lo, hi):
+    """
+        Whether the bracket is as narrow as the noise allows: once the
+        confidence interval of either end covers the target, the rates in
+        between can't be told apart from it with this many replications, and
+        narrowing further would only follow the noise.
+    """
+    _, mean, half = curve({rate: results[rate] for rate in (lo, hi)}, column)
+    return bool(np.any(np.abs(mean - target) <= half))
+
+def interpolate(results, column, target, lo, hi):
+    # Rate where the mean crosses the target, linear between lo and hi
+    rates, mean, _ = curve({rate: results[rate] for rate in (lo, hi)}, column)
+    if not np.all(np.isfinite(mean)) or mean[1] == mean[0]:
+        return hi
+    return lo + (target - mean[0])*(hi - lo)/(mean[1] - mean[0])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offered load at which the network saturates")
+    parser.add_argument("--metric", choices=sorted(METRICS), default="loss",
+                        help="what defines saturation: the loss fraction or the p99 e2e delay")
+    parser.add_argument("--target", type=float, default=None,
+                        help="threshold of the metric (default: {})".format(
+                            ", ".join("{} for {}".format(v, k) for k, v in sorted(TARGETS.items()))))
+    parser.add_argument("--low", type=float, default=None, help="lowest rate to try (default: a tenth of --high)")
+    parser.add_argument("--high", type=float, default=None,
+                        help="highest rate of the first round, packets/s (default: the configured traffic)")
+    parser.add_argument("-b", "--batch", type=int, default=None,
+                        help="rates run in parallel per round (default: the number of workers)")
+    parser.add_argument("-r", "--rounds", type=int, default=8, help="most refinement rounds")
+    parser.add_argument("--rtol", type=float, default=0.01, help="stop once the bracket is this narrow, relative")
+    parser.add_argument("-t", "--sim-time", type=float, default=network.SIM_TIME, help="simulated seconds per run")
+    parser.add_argument("-c", "--servers", type=int, default=network.NUM_SERVERS,
+                        help="servers per router, unless the topology says otherwise")
+    parser.add_argument("--topology", default=None, metavar="FILE",
+                        help="JSON network description (see topology.py), default: the lab network")
+    parser.add_argument("--lindley", action="store_true", help="run with the Lindley recursion (see lindley.py)")
+    parser.add_argument("-n", "--replications", type=int, default=4, help="replications per rate")
+    parser.add_argument("--independent", action="store_true",
+                        help="independent random numbers per rate instead of common random numbers")
+    parser.add_argument("-o", "--output", default="load.csv", help="CSV file the results are streamed to")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="master seed")
+    plotting.add_arguments(parser)
+    args = parser.parse_args()
+    figures = plotting.Figures.from_args(args)
+
+    if args.topology:
+        with open(args.topology) as f:
+            config = json.load(f)
+    else:
+        config = network.default_config()
+    column = METRICS[args.metric]
+    target = TARGETS[args.metric] if args.target is None else args.target
+    high = args.high or sum(r for _, _, r in config["traffic"])
+    low = args.low or high/10
+    batch = args.batch or args.workers or os.cpu_count()
+    # One seed for every round, so that with common random numbers all rates
+    # see the same streams
+    entropy = np.random.SeedSequence(args.seed).entropy
+
+    fn = functools.partial(load_point, config=config, servers=args.servers, sim_time=args.sim_time,
+                           replications=args.replications, fast=args.lindley)
+    results = {}
+    rates = np.linspace(low, high, max(batch, 2))
+    for round_ in range(args.rounds):
+        points = [Load(float(rate)) for rate in rates if float(rate) not in results]
+        seed = entropy if not args.independent else [entropy, round_]
+        for point, rows in sweep.run(fn, points, args.output, seed, args.workers, common=not args.independent,
+                                     append=round_ > 0):
+            results[point.rate] = rows
+        lo, hi = knee(results, column, target)
+        print("Round {}: {} rates run, saturation between {} and {} packets/s".format(
+            round_ + 1, len(results), "?" if lo is None else "{:.4g}".format(lo),
+            "?" if hi is None else "{:.4g}".format(hi)))
+        if lo is not None and hi is not None:
+            if hi - lo <= args.rtol*hi:
+                break
+            if resolved(results, column, target, lo, hi):
+                print("The confidence intervals at {:.4g} and {:.4g} cover {:g}, more replications would be "
+                      "needed to narrow it down".format(lo, hi, target))
+                break
+        rates = next_rates(lo, hi, batch)
+
+    if lo is None:
+        print("{} is at or above {:g} already at {:.4g} packets/s".format(args.metric, target, hi))
+    elif hi is None:
+        print("{} stays below {:g} up to {:.4g} packets/s".format(args.metric, target, lo))
+    else:
+        print("{} reaches {:g} at about {:.4g} packets/s, between {:.4g} and {:.4g}".format(
+            args.metric, target, interpolate(results, column, target, lo, hi), lo, hi))
+    rates, throughput, _ = curve(results, "throughput")
+    _, loss, loss_half = curve(results, "loss")
+    _, delay, _ = curve(results, "e2e_mean")
+    _, p99, _ = curve(results, "e2e_p99")
+    print("    Rate  Throughput              Loss   Mean delay   p99 delay")
+    for row in zip(rates, throughput, loss, loss_half, delay, p99):
+        print("{:8.4g}  {:10.4g}  {:7.2%} +- {:6.2%}  {:10.2f}s  {:9.2f}s".format(*row))
+
+    if not figures.wanted:
+        sys.exit()
+
+    plt = figures.pyplot()
+    fig, axes = plt.subplots(3, 1, sharex=True, figsize=(6, 8))
+    axes[0].plot(rates, throughput, ".-")
+    axes[0].plot(rates, rates, ":", color="grey")
+    axes[0].set_ylabel("Throughput (packets/s)")
+    axes[1].errorbar(rates, 100*loss, 100*np.nan_to_num(loss_half), fmt=".-")
+    axes[1].set_ylabel("Packets lost (%)")
+    axes[2].plot(rates, delay, ".-", rates, p99, ".--")
+    axes[2].legend(["Mean", "p99"])
+    axes[2].set_ylabel("E2E delay (seconds)")
+    axes[2].set_xlabel("Offered load (packets/s)")
+    target_axis = axes[1] if args.metric == "loss" else axes[2]
+    target_axis.axhline(100*target if args.metric == "loss" else target, color="grey", linewidth=0.5)
+    axes[0].set_title("Load sweep", fontsize=16)
+
+    figures.done("load_sweep")
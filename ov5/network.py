@@ -1,128 +1,476 @@
-import random
+import argparse
+import functools
+from collections import namedtuple
 import numpy as np
 import simpy as sp
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from simlib import sampling, replicate
+from simlib.records import RecordStore
+from simlib.sequential import Control
+from simlib.steady import SteadyState
+from simlib.stats import LatencySketch
+from simlib.trace import TraceWriter, TraceReader
+from buffer import DeadlineBuffer
+from topology import Topology
 
 ARRIVAL_RATE = 1/2
 MAX_DELAY = 3
 TRANS_DELAY = 0.2
 SIM_TIME = 300
+NUM_SERVERS = 1 # per router
+KEEP_RECORDS = False # keep one record per packet
+CHECK_INTERVAL = 10 # between precision checks with --precision
+PERCENTILES = (50, 99, 99.9) # of the e2e delay
 
-def arrival_time():
-    return np.random.exponential(ARRIVAL_RATE)
+# What a run leaves behind, small enough to send back from a worker process
+Summary = namedtuple("Summary", ["generated", "lost", "e2e", "drop_age"])
+RouterStats = namedtuple("RouterStats", ["num", "name", "processed", "lost", "mean_queue", "max_queue",
+                                         "utilization"])
 
-def service_time():
-    return np.random.gamma(3,1/3)
+def default_config():
+    # The lab network: r1 and r2 each get half the traffic and forward it to r3
+    service = {"dist": "gamma", "shape": 3, "mean": 1}
+    return {"default": {"service": service},
+            "routers": {"r1": {}, "r2": {}, "r3": {}},
+            "links": [["r1", "r3", TRANS_DELAY], ["r2", "r3", TRANS_DELAY]],
+            "traffic": [["r1", "r3", 1/(2*ARRIVAL_RATE)], ["r2", "r3", 1/(2*ARRIVAL_RATE)]]}
+
+# Per-router and per-source pools are many small ones instead of a few big ones
+STREAM_POOL = 256
+
+def service_shape(spec):
+    # Gamma shape of a router's {"dist": ..., "mean": ...}, None if deterministic
+    dist = spec["dist"]
+    if dist == "deterministic":
+        return None
+    if dist == "exponential":
+        return 1
+    if dist == "gamma":
+        return spec["shape"]
+    raise ValueError("unknown service distribution {!r}".format(dist))
+
+def service_sampler(spec, name):
+    """
+        Service time function for router `name` with service {"dist": ...,
+        "mean": ...}. Every router draws from its own stream, so its service
+        times depend only on how many packets it has served, not on what the
+        rest of the network does (see parallel.py).
+    """
+    shape, mean = service_shape(spec), spec["mean"]
+    if shape is None:
+        return lambda: mean
+    pool, scale = sampling.gamma(shape, size=STREAM_POOL, stream="service/" + name), mean/shape
+    return lambda: scale*pool()
+
+def packet_records():
+    return RecordStore(timestamp=float, router=np.int32, lost=bool, e2e_delay=float)
 
 class Generator:
-    def __init__(self, env, routers):
+    """
+        Every source router sends a Poisson stream at the total rate of its
+        flows; each packet picks one of them with probability proportional to
+        the flow's rate and joins the source's queue. A source draws its
+        inter-arrival times and flows from streams of its own, so the packets
+        it sends are the same whichever other sources run in the same
+        environment; `sources` limits the generator to some of them (see
+        parallel.py). Like the routers it runs on timeout callbacks instead of
+        a process.
+
+        With a TraceWriter every packet's arrival time, flow and service
+        demand at each router on its path are drawn up front and recorded;
+        with a TraceReader the packets come from such a trace instead.
+    """
+    def __init__(self, env, routers, topology, pool, records=None, trace=None, replay=None, sources=None):
         self.env = env
         self.routers = routers
+        self.topology = topology
+        self.pool = pool
+        self.records = records
+        self.trace = trace
         self.generated = 0
-        env.process(self.generate())
+        if trace is not None or replay is not None:
+            self.paths = [topology.path(f) for f in range(len(topology.flow_src))]
+            self.width = max(len(path) for path in self.paths)
+        if replay is not None:
+            self.rows = replay.rows("time", "flow", "service")
+            self.schedule_replay()
+            return
+
+        self.mean, self.arrival, self.routing = {}, {}, {}
+        for s in topology.sources if sources is None else sources:
+            name = topology.names[s]
+            self.mean[s] = 1/topology.source_rate[s]
+            self.arrival[s] = sampling.exponential(size=STREAM_POOL, stream="arrival/" + name)
+            # A source with a single flow needs no draw to pick it
+            if len(topology.source_flows[s]) > 1:
+                self.routing[s] = sampling.uniform(size=STREAM_POOL, stream="routing/" + name)
+            env.timeout(self.mean[s]*self.arrival[s](), s).callbacks.append(self.generate)
 
-    def generate(self):
-        while True:
-            Packet(self.env, routers)
-            self.generated += 1
-            at = arrival_time()
-            yield self.env.timeout(at)
+    def send(self, f, demand=None):
+        topo = self.topology
+        src, k = topo.flow_src[f], topo.flow_row[f]
+        p = self.pool.get(self.env.now, topo.dests[k], k*topo.n)
+        p.demand = demand
+        if self.records is not None:
+            p.row = self.records.append(timestamp=p.timestamp, router=src)
+        self.routers[src].q_packet(p)
+        self.generated += 1
+
+    def generate(self, event):
+        s = event.value
+        routing = self.routing.get(s)
+        f = self.topology.source_flows[s][0] if routing is None else self.topology.flow(s, routing())
+        if self.trace is None:
+            self.send(f)
+        else:
+            demand = [self.routers[node].service() for node in self.paths[f]]
+            self.trace.append(time=self.env.now, flow=f, service=demand + [np.nan]*(self.width - len(demand)))
+            self.send(f, demand)
+        self.env.timeout(self.mean[s]*self.arrival[s](), s).callbacks.append(self.generate)
+
+    def schedule_replay(self):
+        row = next(self.rows, None)
+        if row is not None:
+            self.env.timeout(max(0.0, row[0] - self.env.now), row).callbacks.append(self.replayed)
+
+    def replayed(self, event):
+        _, f, demand = event.value
+        if len(self.paths[f]) > len(demand):
+            raise ValueError("trace has service demands for {} hops, flow {} needs {}".format(
+                len(demand), f, len(self.paths[f])))
+        self.send(f, demand)
+        self.schedule_replay()
 
 class Packet:
-    def __init__(self, env, routers):
-        self.env = env
-        self.routers = routers
-        self.timestamp = env.now
-        self.ttl = True
-        self.routed = False
-        env.process(self.run())
-
-    def run(self):
-        r = self.routers[random.randint(0,1)]
-        #r.q_packet(self)
-        yield r.env.process(r.route(self))
-
-        if(self.ttl):
-            yield self.env.timeout(TRANS_DELAY)
-            r3 = self.routers[2]
-            #r3.q_packet(self)
-            yield r3.env.process(r3.route(self))
-        
+    # Just the data; the routers move packets around, see Router.finish.
+    # demand holds the service time at each hop when it comes from a trace.
+    __slots__ = ("timestamp", "dst", "base", "row", "demand", "hop")
+
+class PacketPool:
+    """
+        Free list of Packet objects. Delivered and dropped packets go back on
+        the list and new arrivals reuse them, so a run only ever allocates as
+        many packets as are in the network at once.
+    """
+    __slots__ = ("free", "created")
+
+    def __init__(self):
+        self.free = []
+        self.created = 0
+
+    def get(self, timestamp, dst, base):
+        if self.free:
+            p = self.free.pop()
+        else:
+            p = Packet()
+            self.created += 1
+        p.timestamp = timestamp
+        p.dst = dst
+        p.base = base
+        p.hop = 0
+        return p
+
+    def put(self, p):
+        self.free.append(p)
+
 
 class Router:
-    def __init__(self, env, num):
+    """
+        A station with `servers` identical servers sharing one FIFO queue.
+        Neither packets nor servers have a process: a service is one timeout
+        whose callback finishes it, after which the router either delivers the
+        packet or hands it to the next hop's transit(), one timeout whose
+        callback is that router's arrive(). Before each service every
+        packet older than MAX_DELAY is purged from the queue in one go (see
+        buffer.py) and counted as lost. Queue length and busy servers are
+        integrated over time for the time-average queue length and the
+        utilization.
+    """
+    __slots__ = ("env", "num", "name", "servers", "service", "stats", "queue", "busy", "last",
+                 "queue_area", "busy_area", "max_queue", "routers", "next_hop", "hop_delay", "pool", "records",
+                 "processed", "lost", "delivered", "e2e", "drop_age")
+
+    def __init__(self, env, num, servers=1, stats=None, service=None, name=None):
         self.env = env
         self.num = num
-        self.packets = []
-        
+        self.name = name or str(num)
+        self.servers = servers
+        # The lab service time on the router's own stream unless told otherwise
+        self.service = service or service_sampler(default_config()["default"]["service"], self.name)
+        self.stats = stats
+        self.queue = DeadlineBuffer()
+        self.busy = 0
+        self.last = env.now
+        self.queue_area = 0.0
+        self.busy_area = 0.0
+        self.max_queue = 0
+
         # Stats
+        self.processed = 0
         self.lost = 0
-        self.tot_e2e_delay = 0
-        self.min_delay = float('inf')
-        self.max_delay = float('-inf')
-        
-        #env.process(self.route())
-
-    def q_packet(self, packet):
-        packet.routed = False
-        self.packets.append(packet)
-
-    def route_(self):
-        if(self.packets != []):
-            p = self.packets.pop(0)
-            if(self.env.now > p.timestamp + MAX_DELAY):
-                p.ttl = False
-                self.lost += 1
-            else:
-                st = service_time()
-                yield self.env.timeout(st)
-            p.routed = True
+        self.delivered = 0 # packets that had this router as destination
+        self.e2e = LatencySketch() # delay of the delivered packets
+        self.drop_age = LatencySketch() # age of the packets dropped here
 
-            # Stats
-            if(self.num == 3):
-                self.processed += 1
-                e2e_delay = self.env.now - p.timestamp
-                self.tot_e2e_delay += e2e_delay
-                if(e2e_delay < self.min_delay):
-                    self.min_delay = e2e_delay
-                if(e2e_delay > self.max_delay):
-                    self.max_delay = e2e_delay
-
-    def route(self, p):
-        if(self.env.now > p.timestamp + MAX_DELAY):
-            p.ttl = False
-            self.lost += 1
+    def connect(self, routers, topology, pool, records=None):
+        # Shared by all routers of a network, nothing of this is per packet
+        self.routers = routers
+        self.next_hop = topology.next_hop
+        self.hop_delay = topology.hop_delay
+        self.pool = pool
+        self.records = records
+
+    def _account(self, now):
+        # Integrate queue length and busy servers up to now
+        dt = now - self.last
+        self.queue_area += dt*self.queue.size
+        self.busy_area += dt*self.busy
+        self.last = now
+
+    def q_packet(self, p):
+        now = self.env.now
+        self._account(now)
+        self.queue.append(p, p.timestamp + MAX_DELAY)
+        if self.queue.size > self.max_queue:
+            self.max_queue = self.queue.size
+        if self.busy < self.servers:
+            self.start(now)
+
+    def transit(self, p, delay):
+        # p leaves the previous hop now and arrives here after the link delay
+        self.env.timeout(delay, p).callbacks.append(self.arrive)
+
+    def arrive(self, transit):
+        # Callback of the transit timeout from the previous hop
+        self.q_packet(transit.value)
+
+    def start(self, now):
+        # Purge, then put idle servers to work on the head of the queue
+        queue = self.queue
+        expired = queue.purge(now)
+        if expired:
+            self.drop(expired, now)
+        while self.busy < self.servers and queue.size:
+            self.busy += 1
+            p = queue.popleft()
+            service = self.service() if p.demand is None else p.demand[p.hop]
+            self.env.timeout(service, p).callbacks.append(self.finish)
+
+    def finish(self, service):
+        now = self.env.now
+        self._account(now)
+        self.busy -= 1
+        self.processed += 1
+        p = service.value
+
+        if p.dst != self.num:
+            i = p.base + self.num
+            p.hop += 1
+            self.routers[self.next_hop[i]].transit(p, self.hop_delay[i])
         else:
-            st = service_time()
-            yield self.env.timeout(st)
-        p.routed = True
+            # Stats
+            self.delivered += 1
+            e2e_delay = now - p.timestamp
+            if self.records is not None:
+                self.records.e2e_delay[p.row] = e2e_delay
+            if self.stats is not None:
+                self.stats.add(p.timestamp, lost=0.0, e2e_delay=e2e_delay)
+            self.e2e.add(e2e_delay)
+            self.pool.put(p)
 
-        # Stats
-        if(self.num == 3):
-            e2e_delay = self.env.now - p.timestamp
-            self.tot_e2e_delay += e2e_delay
-            if(e2e_delay < self.min_delay):
-                self.min_delay = e2e_delay
-            if(e2e_delay > self.max_delay):
-                self.max_delay = e2e_delay
+        if self.queue.size:
+            self.start(now)
+
+    def drop(self, expired, now):
+        self.lost += len(expired)
+        for p in expired:
+            self.drop_age.add(now - p.timestamp)
+            if self.records is not None:
+                self.records.lost[p.row] = True
+            if self.stats is not None:
+                self.stats.add(p.timestamp, lost=1.0)
+            self.pool.put(p)
+
+    def mean_queue(self):
+        # Time-average number of waiting packets so far
+        self._account(self.env.now)
+        return self.queue_area/self.env.now if self.env.now else 0.0
+
+    def utilization(self):
+        self._account(self.env.now)
+        return self.busy_area/(self.env.now*self.servers) if self.env.now else 0.0
+
+def simulate(sim_time=SIM_TIME, precision=None, max_wall=None, steady=False, servers=NUM_SERVERS, topology=None,
+             record=None, replay=None, keep_records=KEEP_RECORDS):
+    """
+        Runs for sim_time, or with a precision until the packet-loss fraction
+        and the e2e delay of delivered packets are known to that relative
+        precision, for at most sim_time (see simlib/sequential.py). With steady=True the two metrics
+        are recorded for a warm-up corrected estimate (simlib/steady.py).
+        The network is `topology` (a Topology) or the lab network with
+        `servers` per router. record and replay are trace directories (see
+        simlib/trace.py) to write the packets' inputs to or to read them from.
+        Returns the generator and the Control or SteadyState (None if neither
+        is used).
+    """
+    topology = topology or Topology(default_config(), servers)
+    env = sp.Environment()
+
+    stats = None
+    if precision is not None:
+        stats = Control(env, ["lost", "e2e_delay"], precision, CHECK_INTERVAL, max_time=sim_time,
+                        max_wall=max_wall)
+    elif steady:
+        stats = SteadyState(["lost", "e2e_delay"])
+    routers = [Router(env, i, topology.servers[i], stats, service_sampler(topology.service[i], name), name)
+               for i, name in enumerate(topology.names)]
+
+    records = packet_records() if keep_records else None
+    pool = PacketPool()
+    for r in routers:
+        r.connect(routers, topology, pool, records)
+    trace = None
+    if record is not None:
+        width = max(len(topology.path(f)) for f in range(len(topology.flow_src)))
+        trace = TraceWriter(record, time=float, flow=np.int32, service=(float, width))
+    gen = Generator(env, routers, topology, pool, records, trace, replay and TraceReader(replay))
+
+    try:
+        env.run(until=stats.done if precision is not None else sim_time)
+    finally:
+        if trace is not None:
+            trace.close()
+    return gen, stats
+
+def summarize(gen):
+    # Totals over all routers of a finished run
+    e2e, drop_age = LatencySketch(), LatencySketch()
+    for r in gen.routers:
+        e2e.merge(r.e2e)
+        drop_age.merge(r.drop_age)
+    return Summary(gen.generated, sum(r.lost for r in gen.routers), e2e, drop_age)
+
+def by_source(records, names):
+    """
+        Per source router (name, packets, fraction lost, e2e delay
+        PERCENTILES of its delivered packets), from the packet records'
+        columns. Packets still in the network at the end count as neither.
+    """
+    router, lost, e2e = records.column("router"), records.column("lost"), records.column("e2e_delay")
+    rows = []
+    for src in np.unique(router).tolist():
+        mine = router == src
+        delivered = e2e[mine & ~np.isnan(e2e)]
+        pct = np.percentile(delivered, PERCENTILES) if len(delivered) else np.full(len(PERCENTILES), np.nan)
+        rows.append((names[src], int(mine.sum()), lost[mine].mean(), pct))
+    return rows
+
+def router_stats(r):
+    return RouterStats(r.num, r.name, r.processed, r.lost, r.mean_queue(), r.max_queue, r.utilization())
 
-env = sp.Environment()
+def replication(seed, sim_time=SIM_TIME, servers=NUM_SERVERS, topology=None):
+    sampling.seed(seed)
+    gen, _ = simulate(sim_time, servers=servers, topology=topology)
+    return summarize(gen)
 
-r1 = Router(env, 1)
-r2 = Router(env, 2)
-r3 = Router(env, 3)
+def percentile_line(name, sketch):
+    label = "{} p{}:".format(name, "/p".join("{:g}".format(q) for q in PERCENTILES))
+    values = " / ".join("{:.2f}s".format(v) for v in sketch.quantiles(np.array(PERCENTILES)/100))
+    return "{:<41s}{}".format(label, values)
 
-routers = [r1, r2, r3]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Packets through a network of routers")
+    parser.add_argument("-t", "--sim-time", type=float, default=SIM_TIME, help="simulated seconds")
+    parser.add_argument("-c", "--servers", type=int, default=NUM_SERVERS,
+                        help="servers per router, unless the topology says otherwise")
+    parser.add_argument("--topology", default=None, metavar="FILE",
+                        help="JSON network description (see topology.py), default: the lab network")
+    parser.add_argument("-p", "--precision", type=float, default=None,
+                        help="run until the loss fraction and e2e delay are known to this relative CI "
+                             "half-width (e.g. 0.05), for at most --sim-time")
+    parser.add_argument("--max-wall", type=float, default=300, help="wall time cap in seconds with --precision")
+    parser.add_argument("--steady", action="store_true",
+                        help="also report steady-state estimates with the warm-up cut off (MSER-5)")
+    parser.add_argument("--record", default=None, metavar="DIR", help="record the arrivals as a trace")
+    parser.add_argument("--replay", default=None, metavar="DIR", help="take the arrivals from a recorded trace")
+    parser.add_argument("--keep-records", action="store_true",
+                        help="keep one record per packet and report loss and delay by source router")
+    parser.add_argument("-P", "--partitions", type=int, default=1,
+                        help="split the routers over this many worker processes (see parallel.py)")
+    parser.add_argument("--lindley", action="store_true",
+                        help="compute the run with the Lindley recursion instead of events (see lindley.py)")
+    parser.add_argument("-n", "--replications", type=int, default=1, help="independent replications")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="seed")
+    args = parser.parse_args()
+    if args.precision is not None and args.steady:
+        parser.error("--precision and --steady are alternatives")
+    if args.record and args.replay:
+        parser.error("--record and --replay are alternatives, a replayed run records nothing")
+    if args.replications > 1 and (args.precision is not None or args.steady or args.record or args.replay):
+        parser.error("--precision, --steady, --record and --replay are for single runs")
+    if (args.partitions > 1 or args.lindley) and (args.replications > 1 or args.precision is not None or args.steady
+                                                  or args.record or args.replay):
+        parser.error("--partitions and --lindley run a single plain --sim-time run")
+    if args.partitions > 1 and args.lindley:
+        parser.error("--partitions and --lindley are alternatives")
+    if args.keep_records and (args.replications > 1 or args.partitions > 1 or args.lindley):
+        parser.error("--keep-records needs a single event-driven run")
 
-gen = Generator(env, routers)
+    if args.seed is not None:
+        sampling.seed(args.seed)
 
-env.run(until=SIM_TIME)
+    topology = None
+    if args.topology:
+        topology = Topology.from_file(args.topology, args.servers, default_config()["default"]["service"])
+    if args.replications > 1:
+        fn = functools.partial(replication, sim_time=args.sim_time, servers=args.servers, topology=topology)
+        runs = replicate.run(fn, args.replications, args.seed, args.workers)
+        mean, half, _ = replicate.confidence_interval([[r.lost/r.generated] for r in runs])
+        e2e, drop_age = LatencySketch(), LatencySketch()
+        for r in runs:
+            e2e.merge(r.e2e)
+            drop_age.merge(r.drop_age)
+        print("Packets lost:                            {}/{}".format(sum(r.lost for r in runs),
+                                                                      sum(r.generated for r in runs)))
+        print("Percentage of packets lost:              {:.2f}% +- {:.2f}%".format(100*mean[0], 100*half[0]))
+        print("Mean end-to-end delay:                   {:.2f}s".format(e2e.mean))
+        print(percentile_line("End-to-end delay", e2e))
+        print(percentile_line("Age of dropped packets", drop_age))
+        sys.exit()
 
-packets_lost = 0
-for r in gen.routers:
-    packets_lost += r.lost
+    stats = records = None
+    if args.lindley:
+        import lindley
+        summary, routers = lindley.simulate(args.sim_time, topology, args.servers)
+    elif args.partitions > 1:
+        import parallel
+        summary, routers = parallel.simulate(topology or Topology(default_config(), args.servers), args.partitions,
+                                             args.sim_time, args.seed)
+    else:
+        gen, stats = simulate(args.sim_time, args.precision, args.max_wall, args.steady, args.servers, topology,
+                              args.record, args.replay, args.keep_records)
+        summary = summarize(gen)
+        records = gen.records
+        routers = [router_stats(r) for r in gen.routers]
 
-print("Packets lost:                            {}/{}".format(packets_lost, gen.generated))
-print("Percentage of packets lost:              {:.2f}%".format(packets_lost/gen.generated*100))
-print("Mean end-to-end delay:                   {:.2f}s".format(r3.tot_e2e_delay/gen.generated))
-print("Minimal delay experienced by a packet:   {:.2f}s".format(r3.min_delay))
-print("Maximal delay experienced by a packet:   {:.2f}s".format(r3.max_delay))
\ No newline at end of file
+    print("Packets lost:                            {}/{}".format(summary.lost, summary.generated))
+    print("Percentage of packets lost:              {:.2f}%".format(summary.lost/summary.generated*100))
+    print("Mean end-to-end delay:                   {:.2f}s".format(summary.e2e.mean))
+    print("Minimal delay experienced by a packet:   {:.2f}s".format(summary.e2e.min))
+    print("Maximal delay experienced by a packet:   {:.2f}s".format(summary.e2e.max))
+    print(percentile_line("End-to-end delay", summary.e2e))
+    print(percentile_line("Age of dropped packets", summary.drop_age))
+    if len(routers) <= 100:
+        for r in routers:
+            print("Router {}: {} served, {} lost, mean queue {:.2f} (max {}), utilization {:.1%}".format(
+                r.name, r.processed, r.lost, r.mean_queue, r.max_queue, r.utilization))
+    if records is not None:
+        label = "/p".join("{:g}".format(q) for q in PERCENTILES)
+        for name, count, lost, pct in by_source(records, [r.name for r in routers]):
+            print("From {}: {} packets, {:.2%} lost, e2e p{} {}".format(
+                name, count, lost, label, " / ".join("{:.2f}s".format(v) for v in pct)))
+    if stats is not None:
+        print(stats.report())
@@ -0,0 +1,176 @@
+import math
+import multiprocessing as mp
+from collections import deque
+import numpy as np
+import simpy as sp
+from simlib import sampling
+from simlib.stats import LatencySketch
+from network import SIM_TIME, Summary, Generator, PacketPool, Router, router_stats, service_sampler
+
+def partition(topology, parts):
+    """
+        Router -> partition, as `parts` contiguous blocks of a breadth-first
+        order of the links, so that neighbours mostly end up together and few
+        packets have to cross between workers.
+    """
+    seen = [False]*topology.n
+    order = []
+    indptr, indices = topology.indptr.tolist(), topology.indices.tolist()
+    for root in range(topology.n):
+        if seen[root]:
+            continue
+        seen[root] = True
+        todo = deque([root])
+        while todo:
+            u = todo.popleft()
+            order.append(u)
+            for v in indices[indptr[u]:indptr[u + 1]]:
+                if not seen[v]:
+                    seen[v] = True
+                    todo.append(v)
+    assignment = [0]*topology.n
+    for part, block in enumerate(np.array_split(order, parts)):
+        for u in block.tolist():
+            assignment[u] = part
+    return assignment
+
+def lookahead(topology, assignment):
+    # Least link delay of any route hop from one partition into another,
+    # infinite if no route crosses
+    nh = np.frombuffer(topology.next_hop, dtype=np.int32)
+    delay = np.frombuffer(topology.hop_delay, dtype=float)
+    part = np.array(assignment)
+    u = np.tile(np.arange(topology.n), len(topology.dests))
+    cross = (nh >= 0) & (part[u] != part[np.maximum(nh, 0)])
+    if not cross.any():
+        return math.inf
+    smallest = delay[cross].min()
+    if smallest <= 0:
+        raise ValueError("a zero-delay link joins two partitions, there is no lookahead")
+    return float(smallest)
+
+def delay_to(now, t):
+    # Timeout delay that lands exactly on t: t - now may round, so that a
+    # packet arrives at the same time as in the sequential run
+    d = t - now
+    while now + d < t:
+        d = float(np.nextafter(d, np.inf))
+    while now + d > t:
+        d = float(np.nextafter(d, -np.inf))
+    return d
+
+class Remote:
+    """
+        Stand-in for a router of another partition. A packet handed to it
+        leaves through the outbox as (arrival time, router, timestamp, dst,
+        base, hop) and goes back on the pool; the router's own worker
+        recreates it.
+    """
+    __slots__ = ("env", "num", "outbox", "pool")
+
+    def __init__(self, env, num, outbox, pool):
+        self.env = env
+        self.num = num
+        self.outbox = outbox
+        self.pool = pool
+
+    def transit(self, p, delay):
+        self.outbox.append((self.env.now + delay, self.num, p.timestamp, p.dst, p.base, p.hop))
+        self.pool.put(p)
+
+def _worker(conn, topology, assignment, part, seed):
+    # Runs one partition window by window as the coordinator says
+    sampling.seed(seed)
+    env = sp.Environment()
+    pool = PacketPool()
+    outbox = []
+    routers = [Router(env, i, topology.servers[i], None, service_sampler(topology.service[i], name), name)
+               if assignment[i] == part else Remote(env, i, outbox, pool)
+               for i, name in enumerate(topology.names)]
+    local = [r for r in routers if isinstance(r, Router)]
+    for r in local:
+        r.connect(routers, topology, pool)
+    gen = Generator(env, routers, topology, pool, sources=[s for s in topology.sources if assignment[s] == part])
+
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        until, inbox = msg
+        now = env.now
+        for t, num, timestamp, dst, base, hop in inbox:
+            p = pool.get(timestamp, dst, base)
+            p.hop = hop
+            p.demand = None
+            env.timeout(delay_to(now, t), p).callbacks.append(routers[num].arrive)
+        env.run(until=until)
+        conn.send((outbox, env.peek()))
+        outbox.clear()
+
+    conn.send((gen.generated, [(r.e2e, r.drop_age, router_stats(r)) for r in local]))
+    conn.close()
+
+def simulate(topology, parts, sim_time=SIM_TIME, seed=None):
+    """
+        The same run as network.simulate(sim_time, topology=topology) after
+        sampling.seed(seed), spread over `parts` worker processes that each
+        own a partition of the routers and the traffic sources among them.
+
+        Conservative synchronous windows: a packet that leaves a partition at
+        time s arrives no earlier than s + L, L being the least link delay
+        between partitions. With every worker's next event (and every packet
+        in flight between workers) no earlier than m, nothing a worker does
+        before m + L can depend on another partition, so each round all
+        workers run up to there, then send the packets that crossed as one
+        batch per worker through the coordinator, which hands them to their
+        router's worker for the next round. Every source and router draws
+        from its own streams, so the result is the sequential one, barring
+        events at exactly the same time.
+
+        Returns the Summary and the RouterStats in router order.
+    """
+    assignment = partition(topology, parts)
+    window = lookahead(topology, assignment)
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    ctx = mp.get_context("fork")
+    conns, procs = [], []
+    for part in range(parts):
+        ours, theirs = ctx.Pipe()
+        proc = ctx.Process(target=_worker, args=(theirs, topology, assignment, part, seed), daemon=True)
+        proc.start()
+        theirs.close()
+        conns.append(ours)
+        procs.append(proc)
+
+    inboxes = [[] for _ in range(parts)]
+    peeks = [0.0]*parts
+    now = 0.0
+    while now < sim_time:
+        earliest = min(min(peeks), min((m[0] for inbox in inboxes for m in inbox), default=math.inf))
+        now = min(earliest + window, sim_time)
+        for conn, inbox in zip(conns, inboxes):
+            conn.send((now, inbox))
+        inboxes = [[] for _ in range(parts)]
+        for part, conn in enumerate(conns):
+            outbox, peeks[part] = conn.recv()
+            for m in outbox:
+                inboxes[assignment[m[1]]].append(m)
+
+    generated = 0
+    rows = [None]*topology.n
+    for conn in conns:
+        conn.send(None)
+        count, local = conn.recv()
+        generated += count
+        for e2e, drop_age, stats in local:
+            rows[stats.num] = e2e, drop_age, stats
+    for proc in procs:
+        proc.join()
+
+    # Merged in router order, as network.summarize does
+    e2e, drop_age = LatencySketch(), LatencySketch()
+    for r_e2e, r_drop_age, _ in rows:
+        e2e.merge(r_e2e)
+        drop_age.merge(r_drop_age)
+    stats = [s for _, _, s in rows]
+    return Summary(generated, sum(s.lost for s in stats), e2e, drop_age), stats
@@ -0,0 +1,130 @@
+import heapq
+import json
+from array import array
+from bisect import bisect_right
+import numpy as np
+
+class Topology:
+    """
+        Routers, links and traffic of a network, from a dict or a JSON file:
+
+            {
+              "default": {"servers": 1, "service": {"dist": "gamma", "shape": 3, "mean": 1}},
+              "routers": {"r3": {"servers": 2}},
+              "links":   [["r1", "r3", 0.2], ["r2", "r3", 0.2]],
+              "traffic": [["r1", "r3", 1.0], ["r2", "r3", 1.0]]
+            }
+
+        Links are [from, to, transmission delay] and work both ways unless
+        "directed" is true. Traffic entries are [source, destination, packets
+        per second]. Routers only need an entry to override the defaults;
+        every name used in a link or flow is a router. Service distributions
+        are "gamma" (integer shape), "exponential" or "deterministic", each
+        with a mean.
+
+        The links are kept as CSR adjacency arrays, and routes are computed
+        once: for every destination that receives traffic, a Dijkstra from the
+        destination (least total link delay, then fewest hops) fills one row
+        of the flat next_hop/hop_delay tables. Forwarding a packet at node u
+        towards destination row k is then next_hop[k*n + u], however big the
+        network.
+    """
+    def __init__(self, config, servers=1, service=None):
+        default = dict(config.get("default", {}))
+        default.setdefault("servers", servers)
+        default.setdefault("service", service)
+        routers = config.get("routers", {})
+        links = config["links"]
+        traffic = config["traffic"]
+
+        names = list(routers)
+        for a, b, _ in list(links) + list(traffic):
+            names.extend((a, b))
+        self.names = list(dict.fromkeys(names))
+        self.index = {name: i for i, name in enumerate(self.names)}
+        n = self.n = len(self.names)
+        self.servers = [routers.get(name, {}).get("servers", default["servers"]) for name in self.names]
+        self.service = [routers.get(name, {}).get("service", default["service"]) for name in self.names]
+
+        src = np.array([self.index[a] for a, _, _ in links], dtype=np.int32)
+        dst = np.array([self.index[b] for _, b, _ in links], dtype=np.int32)
+        delay = np.array([d for _, _, d in links], dtype=float)
+        if not config.get("directed", False):
+            src, dst, delay = np.concatenate((src, dst)), np.concatenate((dst, src)), np.concatenate((delay, delay))
+        if np.any(delay < 0):
+            raise ValueError("link delays must not be negative")
+        self.indptr, self.indices, self.delays = self._csr(src, dst, delay)
+        # Incoming links, for the routing pass from each destination
+        rev_ptr, rev_idx, rev_delay = self._csr(dst, src, delay)
+
+        # Flows, grouped by source router; each source draws its packets' flow
+        # by rate with one bisect on the source's cumulative rates
+        self.flow_src = [self.index[a] for a, _, _ in traffic]
+        flow_dst = [self.index[b] for _, b, _ in traffic]
+        self.dests = list(dict.fromkeys(flow_dst))
+        row = {d: k for k, d in enumerate(self.dests)}
+        self.flow_row = [row[d] for d in flow_dst]
+        rates = np.array([r for _, _, r in traffic], dtype=float)
+        if not len(rates) or np.any(rates < 0) or rates.sum() <= 0:
+            raise ValueError("traffic needs at least one flow with a positive rate")
+        self.rate = rates.sum()
+        self.flow_rate = rates.tolist()
+        self.source_flows = [[] for _ in range(n)]
+        for f, s in enumerate(self.flow_src):
+            if self.flow_rate[f] > 0:
+                self.source_flows[s].append(f)
+        self.sources = [s for s in range(n) if self.source_flows[s]]
+        self.source_rate = [sum(self.flow_rate[f] for f in flows) for flows in self.source_flows]
+        self.source_cum = [np.cumsum([self.flow_rate[f] for f in flows]).tolist() for flows in self.source_flows]
+
+        self.next_hop = array("i", [-1])*(len(self.dests)*n)
+        self.hop_delay = array("d", [0.0])*(len(self.dests)*n)
+        rev = rev_ptr.tolist(), rev_idx.tolist(), rev_delay.tolist()
+        for k, d in enumerate(self.dests):
+            self._route_to(d, k*n, *rev)
+        for s, k in zip(self.flow_src, self.flow_row):
+            if s != self.dests[k] and self.next_hop[k*n + s] < 0:
+                raise ValueError("no route from {} to {}".format(self.names[s], self.names[self.dests[k]]))
+
+    @classmethod
+    def from_file(cls, path, servers=1, service=None):
+        with open(path) as f:
+            return cls(json.load(f), servers, service)
+
+    def _csr(self, src, dst, delay):
+        order = np.argsort(src, kind="stable")
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=self.n)))).astype(np.int64)
+        return indptr, dst[order], delay[order]
+
+    def _route_to(self, d, base, ptr, idx, delay):
+        dist = [float("inf")]*self.n
+        hops = [0]*self.n
+        dist[d] = 0.0
+        heap = [(0.0, 0, d)]
+        while heap:
+            du, hu, u = heapq.heappop(heap)
+            if (du, hu) > (dist[u], hops[u]):
+                continue
+            # u is settled; every router with a link into u may go through it
+            for j in range(ptr[u], ptr[u + 1]):
+                v = idx[j]
+                dv, hv = du + delay[j], hu + 1
+                if (dv, hv) < (dist[v], hops[v]):
+                    dist[v], hops[v] = dv, hv
+                    self.next_hop[base + v] = u
+                    self.hop_delay[base + v] = delay[j]
+                    heapq.heappush(heap, (dv, hv, v))
+
+    def path(self, f):
+        # Routers flow f visits, source and destination included
+        node, dst, base = self.flow_src[f], self.dests[self.flow_row[f]], self.flow_row[f]*self.n
+        path = [node]
+        while node != dst:
+            node = self.next_hop[base + node]
+            path.append(node)
+        return path
+
+    def flow(self, s, u):
+        # Flow index of source s for a uniform u in [0, 1)
+        flows, cum = self.source_flows[s], self.source_cum[s]
+        return flows[min(bisect_right(cum, u*cum[-1]), len(flows) - 1)]
@@ -0,0 +1 @@
+# Shared helpers for the lab2/ov4/ov5 simulation models.
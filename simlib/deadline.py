@@ -0,0 +1,17 @@
+def race(env, duration, deadline):
+    """
+        Waits for a task that takes `duration` seconds or until `deadline`
+        seconds have passed, whichever comes first, inside the calling process:
+
+            connected = yield from race(env, conn_time, MAX_CONNECTION_TIME)
+
+        The duration is known up front, so the winner is decided right away
+        and only one timeout is scheduled. Returns True if the task finished
+        in time; on a tie it does. No second process and no Interrupt are
+        involved.
+    """
+    if duration <= deadline:
+        yield env.timeout(duration)
+        return True
+    yield env.timeout(deadline)
+    return False
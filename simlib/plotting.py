@@ -0,0 +1,54 @@
+import os
+import sys
+
+def add_arguments(parser):
+    parser.add_argument("--no-plot", action="store_true", help="don't draw any figures")
+    parser.add_argument("--out", metavar="DIR", default=None,
+                        help="write figures as PNG files to DIR instead of opening a window")
+
+class Figures:
+    """
+        Lazy matplotlib. pyplot is only imported when a figure is actually
+        drawn, with the non-interactive Agg backend when writing to files or
+        running without a display, so batch runs and worker processes never
+        pay for it.
+    """
+    def __init__(self, no_plot=False, out=None):
+        self.no_plot = no_plot
+        self.out = out
+        self._plt = None
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.no_plot, args.out)
+
+    @property
+    def wanted(self):
+        return not self.no_plot
+
+    def pyplot(self):
+        if self._plt is None:
+            import matplotlib
+            if self.out is not None or self.headless():
+                matplotlib.use("Agg")
+            import matplotlib.pyplot as plt
+            self._plt = plt
+        return self._plt
+
+    @staticmethod
+    def headless():
+        return sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+    def done(self, name):
+        # Saves the current figure as DIR/name.png, or shows it when there is
+        # a display. Without one, figures land in the working directory.
+        plt = self.pyplot()
+        if self.out is None and not self.headless():
+            plt.show()
+            return None
+        out = self.out or "."
+        os.makedirs(out, exist_ok=True)
+        path = os.path.join(out, name + ".png")
+        plt.savefig(path)
+        plt.close()
+        return path
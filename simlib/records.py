@@ -0,0 +1,51 @@
+import numpy as np
+
+class RecordStore:
+    """
+        Struct-of-arrays storage for per-entity outcomes. Each column is a
+        preallocated NumPy array that doubles in size when full, so appending
+        is amortised O(1) and reading a column back is a zero-copy view.
+
+            store = RecordStore(arrival=float, lost=bool)
+            row = store.append(arrival=env.now)
+            store.lost[row] = True
+            store.column("arrival")    # view of the filled part
+    """
+    def __init__(self, capacity=1024, **columns):
+        self.n = 0
+        self.capacity = capacity
+        self.names = list(columns)
+        self.defaults = {name: np.nan if np.dtype(dtype).kind == "f" else 0
+                         for name, dtype in columns.items()}
+        for name, dtype in columns.items():
+            a = np.empty(capacity, dtype=dtype)
+            a.fill(self.defaults[name])
+            setattr(self, name, a)
+
+    def _grow(self):
+        self.capacity *= 2
+        for name in self.names:
+            old = getattr(self, name)
+            a = np.empty(self.capacity, dtype=old.dtype)
+            a[:self.n] = old[:self.n]
+            a[self.n:] = self.defaults[name]
+            setattr(self, name, a)
+
+    def append(self, **values):
+        # Returns the new row; columns not given keep their default (NaN/0)
+        if self.n == self.capacity:
+            self._grow()
+        row = self.n
+        for name, value in values.items():
+            getattr(self, name)[row] = value
+        self.n += 1
+        return row
+
+    def __len__(self):
+        return self.n
+
+    def column(self, name):
+        return getattr(self, name)[:self.n]
+
+    def columns(self):
+        return {name: self.column(name) for name in self.names}
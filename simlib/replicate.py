@@ -0,0 +1,57 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+import numpy as np
+
+def run(fn, n, seed=None, workers=None):
+    """
+        Runs fn(seed_sequence) for n independent replications and returns the
+        results in replication order. Every replication gets its own child of
+        np.random.SeedSequence(seed), so for a given master seed the results
+        don't depend on the number of workers. fn must be picklable (a module
+        level function) when workers != 1.
+    """
+    children = np.random.SeedSequence(seed).spawn(n)
+    if workers == 1 or n == 1:
+        return [fn(child) for child in children]
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as ex:
+        # A few chunks per worker keeps the pickling overhead low while still
+        # balancing replications of uneven length
+        chunksize = max(1, n // (4*workers))
+        return list(ex.map(fn, children, chunksize=chunksize))
+
+def t_quantile(p, df):
+    # Student t quantile. Exact for df <= 2, Cornish-Fisher expansion
+    # (Abramowitz & Stegun 26.7.5) otherwise, which is plenty for CIs.
+    if df == 1:
+        return math.tan(math.pi*(p - 0.5))
+    if df == 2:
+        return (2*p - 1)/math.sqrt(2*p*(1 - p))
+    z = NormalDist().inv_cdf(p)
+    g1 = (z**3 + z)/4
+    g2 = (5*z**5 + 16*z**3 + 3*z)/96
+    g3 = (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/384
+    g4 = (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z)/92160
+    return z + g1/df + g2/df**2 + g3/df**3 + g4/df**4
+
+def confidence_interval(samples, level=0.95):
+    """
+        Mean and CI half-width along the first axis, ignoring NaNs (e.g. an
+        hour where a replication had no planes). Returns (mean, half_width,
+        count); half_width is NaN where fewer than two samples exist.
+    """
+    samples = np.asarray(samples, dtype=float)
+    count = np.sum(~np.isnan(samples), axis=0)
+    valid = count > 0
+    mean = np.full(samples.shape[1:], np.nan)
+    half = np.full(samples.shape[1:], np.nan)
+    mean[valid] = np.nanmean(samples[:, valid], axis=0)
+    many = count > 1
+    if np.any(many):
+        sd = np.nanstd(samples[:, many], axis=0, ddof=1)
+        t = np.array([t_quantile(0.5 + level/2, c - 1) for c in count[many]])
+        half[many] = t*sd/np.sqrt(count[many])
+    return mean, half, count
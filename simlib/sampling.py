@@ -0,0 +1,107 @@
+import weakref
+import zlib
+import numpy as np
+
+# Number of variates drawn per refill. Large enough that the per-call NumPy
+# overhead disappears, small enough that a short run doesn't waste much.
+BLOCK_SIZE = 4096
+
+# Spawn-key level under which the named streams are derived, far away from
+# the children a SeedSequence.spawn() hands out
+STREAM_KEY = 2**32 - 1
+
+_base = np.random.SeedSequence()
+_rng = np.random.default_rng(_base)
+_streams = {}
+_antithetic = False
+_pools = weakref.WeakSet()
+
+def seed(s, antithetic=False):
+    """
+        Reseeds the shared generator and the named streams and empties every
+        pool, so nothing drawn before the call leaks into the new stream. `s`
+        may be an int or a np.random.SeedSequence (e.g. one child per
+        replication). With antithetic=True every named stream hands out the
+        mirror image F^-1(1 - U) of what it gives with the same seed otherwise.
+    """
+    global _rng, _base, _antithetic
+    _base = s if isinstance(s, np.random.SeedSequence) else np.random.SeedSequence(s)
+    _rng = np.random.default_rng(_base)
+    _streams.clear()
+    _antithetic = antithetic
+    for pool in _pools:
+        pool.buf = []
+        pool.i = 0
+
+def default_rng():
+    return _rng
+
+def stream_rng(name):
+    """
+        Generator dedicated to one stochastic input, e.g. "turnaround". It only
+        depends on the seed and the name, so two scenarios run with the same
+        seed see the same numbers on every input no matter how often the other
+        inputs are sampled (common random numbers).
+    """
+    if name not in _streams:
+        key = _base.spawn_key + (STREAM_KEY, zlib.crc32(name.encode()))
+        _streams[name] = np.random.default_rng(np.random.SeedSequence(_base.entropy, spawn_key=key))
+    return _streams[name]
+
+def _uniforms(name, n):
+    # Uniforms in (0, 1) from a named stream, mirrored in antithetic runs
+    u = stream_rng(name).random(n)
+    np.maximum(u, 0.5**53, out=u)
+    return 1 - u if _antithetic else u
+
+class Pool:
+    """
+        Hands out pre-drawn variates one at a time and refills itself with a
+        new block when it runs dry. `draw(n)` must return n values.
+    """
+    def __init__(self, draw, size=BLOCK_SIZE):
+        self.draw = draw
+        self.size = size
+        self.buf = []
+        self.i = 0
+        _pools.add(self)
+
+    def refill(self):
+        self.buf = self.draw(self.size).tolist()
+        self.i = 0
+
+    def __call__(self):
+        if self.i == len(self.buf):
+            self.refill()
+        v = self.buf[self.i]
+        self.i += 1
+        return v
+
+"""
+    Pools hand out *standard* variates (unit scale) so the models can keep
+    reading their parameters at call time, e.g. MU_DELAY * gamma3(). This way a
+    module constant changed between runs is picked up without rebuilding the pool.
+    The rng is looked up on every refill, so seed() also affects existing pools.
+
+    With `stream` the pool draws from its own named stream (see stream_rng)
+    by inversion of uniforms, which is what makes antithetic runs possible.
+    Gamma variates are then sums of `shape` exponentials, so they need an
+    integer shape.
+"""
+def uniform(rng=None, size=BLOCK_SIZE, stream=None):
+    if stream:
+        return Pool(lambda n: _uniforms(stream, n), size)
+    return Pool(lambda n: (rng or _rng).random(n), size)
+
+def exponential(rng=None, size=BLOCK_SIZE, stream=None):
+    if stream:
+        return Pool(lambda n: -np.log(_uniforms(stream, n)), size)
+    return Pool(lambda n: (rng or _rng).standard_exponential(n), size)
+
+def gamma(shape, rng=None, size=BLOCK_SIZE, stream=None):
+    if stream:
+        if shape != int(shape):
+            raise ValueError("gamma streams need an integer shape, got {}".format(shape))
+        k = int(shape)
+        return Pool(lambda n: -np.log(_uniforms(stream, n*k)).reshape(n, k).sum(axis=1), size)
+    return Pool(lambda n: (rng or _rng).standard_gamma(shape, n), size)
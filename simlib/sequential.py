@@ -0,0 +1,78 @@
+import math
+import time
+from simlib.stats import BatchMeans
+
+class Control:
+    """
+        Sequential stopping for a single SimPy run. The model adds observations
+        of each metric (0/1 per attempt for a loss ratio, one value per packet
+        for a delay, ...) with add(env.now, metric=value) like to HourlyStats
+        or SteadyState, and every `interval` simulated seconds the control
+        checks the batch-means confidence interval of every metric. The run
+        stops once each half-width is within `precision` of its mean, e.g.
+        precision=0.05 for +-5%:
+
+            control = Control(env, ["lost", "delay"], 0.05, 3600, max_wall=60)
+            ...
+            env.run(until=control.done)
+
+        max_time (simulated seconds) and max_wall (real seconds, only checked
+        at the checkpoints) cap runs that never get there; `reason` tells which
+        condition ended the run. A metric needs at least min_count
+        observations and a nonzero mean before it counts as precise: a
+        relative precision around 0 (a loss ratio with no losses yet) would
+        accept 0 +- 0.
+    """
+    def __init__(self, env, metrics, precision, interval, level=0.95, batches=20, min_count=1000,
+                 max_time=None, max_wall=None):
+        self.env = env
+        self.precision = precision
+        self.interval = interval
+        self.level = level
+        self.min_count = min_count
+        self.max_time = max_time
+        self.max_wall = max_wall
+        self.stats = {m: BatchMeans(batches) for m in metrics}
+        self.done = env.event()
+        self.reason = None
+        self.wall = 0.0
+        env.process(self.watch())
+
+    def add(self, time, **values):
+        for metric, value in values.items():
+            self.stats[metric].add(value)
+
+    def precise(self, metric):
+        b = self.stats[metric]
+        if b.count < self.min_count:
+            return False
+        mean, half = b.interval(self.level)
+        return mean != 0 and half <= self.precision*abs(mean)
+
+    def watch(self):
+        start = time.perf_counter()
+        while True:
+            yield self.env.timeout(self.interval)
+            self.wall = time.perf_counter() - start
+            if all(self.precise(m) for m in self.stats):
+                self.reason = "precision reached"
+            elif self.max_time is not None and self.env.now >= self.max_time:
+                self.reason = "simulated time limit"
+            elif self.max_wall is not None and self.wall >= self.max_wall:
+                self.reason = "wall time limit"
+            else:
+                continue
+            self.done.succeed()
+            return
+
+    def estimates(self):
+        # {metric: (mean, half_width, observations)}
+        return {m: b.interval(self.level) + (b.count,) for m, b in self.stats.items()}
+
+    def report(self):
+        lines = ["Stopped after {:.0f} simulated seconds ({:.1f}s wall): {}".format(
+            self.env.now, self.wall, self.reason)]
+        for m, (mean, half, count) in self.estimates().items():
+            rel = half/abs(mean) if mean else math.nan
+            lines.append("  {:<12s} {:.6g} +- {:.3g} ({:.1%}, {} observations)".format(m, mean, half, rel, count))
+        return "\n".join(lines)
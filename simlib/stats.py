@@ -0,0 +1,209 @@
+import math
+import numpy as np
+from simlib.replicate import t_quantile
+
+class Welford:
+    """
+        Running count, mean, variance, min and max in constant memory
+        (Welford's online algorithm). Accumulators can be merged, e.g. across
+        replications or worker processes.
+    """
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        d = x - self.mean
+        self.mean += d/self.count
+        self.m2 += d*(x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def merge(self, other):
+        # Chan et al. parallel update
+        if other.count == 0:
+            return self
+        n = self.count + other.count
+        d = other.mean - self.mean
+        self.m2 += other.m2 + d*d*self.count*other.count/n
+        self.mean += d*other.count/n
+        self.count = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def var(self):
+        return self.m2/(self.count - 1) if self.count > 1 else math.nan
+
+class BatchMeans:
+    """
+        Mean of a correlated series (e.g. successive packet delays) with a
+        batch-means confidence interval, in constant memory. Observations fill
+        between `batches` and 2*`batches` batches of equal size; once all of
+        them are full, neighbours are merged pairwise and the batch size
+        doubles, so the batches keep growing with the run.
+    """
+    __slots__ = ("batches", "size", "sums", "partial", "fill", "count")
+
+    def __init__(self, batches=20):
+        self.batches = batches
+        self.size = 1
+        self.sums = []
+        self.partial = 0.0
+        self.fill = 0
+        self.count = 0
+
+    def add(self, x):
+        self.count += 1
+        self.partial += x
+        self.fill += 1
+        if self.fill == self.size:
+            self.sums.append(self.partial)
+            self.partial = 0.0
+            self.fill = 0
+            if len(self.sums) == 2*self.batches:
+                s = self.sums
+                self.sums = [s[i] + s[i + 1] for i in range(0, len(s), 2)]
+                self.size *= 2
+
+    def interval(self, level=0.95):
+        # (mean, half_width) over the full batches; the half-width is NaN
+        # with fewer than two batches
+        k = len(self.sums)
+        if k == 0:
+            return math.nan, math.nan
+        means = np.array(self.sums)/self.size
+        if k == 1:
+            return means[0], math.nan
+        return means.mean(), t_quantile(0.5 + level/2, k - 1)*means.std(ddof=1)/math.sqrt(k)
+
+class LatencySketch:
+    """
+        Fixed-memory histogram of non-negative values such as delays, on
+        logarithmic buckets (HDR histogram / DDSketch style): any quantile is
+        returned within `precision` relative error, whatever the number of
+        values, and values at or below `lowest` count as `lowest`. Sketches
+        with the same bounds merge by adding their counts, e.g. across
+        replications or worker processes.
+    """
+    __slots__ = ("lowest", "highest", "precision", "log_gamma", "counts", "count", "total", "min", "max")
+
+    def __init__(self, lowest=1e-6, highest=1e6, precision=0.01):
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self.log_gamma = math.log((1 + precision)/(1 - precision))
+        # Bucket i holds (lowest*gamma^(i-1), lowest*gamma^i]
+        self.counts = [0]*(math.ceil(math.log(highest/lowest)/self.log_gamma) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        if x <= self.lowest:
+            self.counts[0] += 1
+        else:
+            i = math.ceil(math.log(x/self.lowest)/self.log_gamma)
+            self.counts[min(i, len(self.counts) - 1)] += 1
+
+    def extend(self, values):
+        # add() for a whole array at once
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return self
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            i = np.ceil(np.log(values/self.lowest)/self.log_gamma)
+        i = np.where(values <= self.lowest, 0, np.minimum(i, len(self.counts) - 1)).astype(np.int64)
+        added = np.bincount(i, minlength=len(self.counts)).tolist()
+        self.counts = [a + b for a, b in zip(self.counts, added)]
+        return self
+
+    def merge(self, other):
+        if (other.lowest, other.highest, other.precision) != (self.lowest, self.highest, self.precision):
+            raise ValueError("can only merge sketches with the same bounds and precision")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else math.nan
+
+    def quantiles(self, qs):
+        # Array of quantiles for the probabilities qs, NaN while empty
+        qs = np.asarray(qs, dtype=float)
+        if not self.count:
+            return np.full(qs.shape, math.nan)
+        rank = qs*(self.count - 1)
+        i = np.searchsorted(np.cumsum(self.counts), rank, side="right")
+        # Value in the middle of the bucket in relative terms
+        gamma = math.exp(self.log_gamma)
+        value = np.where(i == 0, self.lowest, 2*self.lowest*np.exp(i*self.log_gamma)/(1 + gamma))
+        return np.clip(value, self.min, self.max)
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
+
+class HourlyStats:
+    """
+        One Welford accumulator per metric and hour of arrival. With fold=True
+        arrivals on later days count towards their hour of day (for multi-day
+        runs), otherwise arrivals after the last hour are ignored.
+    """
+    def __init__(self, metrics, hours=24, width=3600, fold=False):
+        self.metrics = list(metrics)
+        self.hours = hours
+        self.width = width
+        self.fold = fold
+        self.acc = {m: [Welford() for _ in range(hours)] for m in self.metrics}
+
+    def add(self, time, **values):
+        hour = int(time//self.width)
+        if self.fold:
+            hour %= self.hours
+        elif not 0 <= hour < self.hours:
+            return
+        for metric, value in values.items():
+            self.acc[metric][hour].add(value)
+
+    def merge(self, other):
+        for m in self.metrics:
+            for mine, theirs in zip(self.acc[m], other.acc[m]):
+                mine.merge(theirs)
+        return self
+
+    def _table(self, get):
+        return np.array([[get(w) for w in self.acc[m]] for m in self.metrics])
+
+    def count(self):
+        return self._table(lambda w: w.count)
+
+    def mean(self):
+        # Indexed [metric, hour], NaN for empty hours
+        return self._table(lambda w: w.mean if w.count else math.nan)
+
+    def var(self):
+        return self._table(lambda w: w.var)
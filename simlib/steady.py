@@ -0,0 +1,80 @@
+import math
+from array import array
+from collections import namedtuple
+import numpy as np
+from simlib.replicate import t_quantile
+
+Estimate = namedtuple("Estimate", ["mean", "half", "count", "warmup", "warmup_time", "raw_mean"])
+
+def mser(values, batch=5):
+    """
+        Number of leading observations to drop as warm-up, by MSER-5 (White
+        1997): the series is averaged in batches of `batch` and the truncation
+        point d minimises the squared standard error of the remaining batch
+        means, sum((y - mean)^2)/(k - d)^2. As usual only the first half of the
+        series is considered. All d are evaluated at once with reverse
+        cumulative sums.
+    """
+    values = np.asarray(values, dtype=float)
+    k = len(values)//batch
+    if k < 4:
+        return 0
+    y = values[:k*batch].reshape(k, batch).mean(axis=1)
+    y = y - y.mean()
+    s1 = np.cumsum(y[::-1])[::-1]
+    s2 = np.cumsum((y*y)[::-1])[::-1]
+    n = np.arange(k, 0, -1)
+    stat = (s2 - s1*s1/n)/(n*n)
+    return int(np.argmin(stat[:k//2]))*batch
+
+def batch_means(values, batches=20, level=0.95):
+    # (mean, half_width) from `batches` equal batches; the few observations
+    # that don't fill a batch are taken from the front
+    values = np.asarray(values, dtype=float)
+    size = len(values)//batches
+    if size == 0:
+        return (values.mean() if len(values) else math.nan), math.nan
+    means = values[len(values) - size*batches:].reshape(batches, size).mean(axis=1)
+    return means.mean(), t_quantile(0.5 + level/2, batches - 1)*means.std(ddof=1)/math.sqrt(batches)
+
+class SteadyState:
+    """
+        Steady-state estimates from one long run that starts empty. The model
+        adds observations in the order they happen (same call as HourlyStats):
+
+            stats.add(env.now, lost=0.0, e2e_delay=d)
+
+        and they are kept as flat float arrays (16 bytes per observation). At
+        the end each metric is cut at its own MSER-5 truncation point and the
+        mean and its confidence interval come from batch means over the rest.
+    """
+    def __init__(self, metrics):
+        self.metrics = list(metrics)
+        self.times = {m: array("d") for m in self.metrics}
+        self.values = {m: array("d") for m in self.metrics}
+
+    def add(self, time, **values):
+        for metric, value in values.items():
+            self.times[metric].append(time)
+            self.values[metric].append(value)
+
+    def series(self, metric):
+        return np.array(self.times[metric]), np.array(self.values[metric])
+
+    def estimate(self, metric, batches=20, level=0.95):
+        times, values = self.series(metric)
+        if not len(values):
+            return Estimate(math.nan, math.nan, 0, 0, math.nan, math.nan)
+        d = mser(values)
+        mean, half = batch_means(values[d:], batches, level)
+        return Estimate(mean, half, len(values) - d, d, times[d], values.mean())
+
+    def estimates(self, batches=20, level=0.95):
+        return {m: self.estimate(m, batches, level) for m in self.metrics}
+
+    def report(self, batches=20, level=0.95):
+        lines = ["Steady state (MSER-5 warm-up, {} batch means, {:.0%} CI):".format(batches, level)]
+        for m, e in self.estimates(batches, level).items():
+            lines.append("  {:<12s} {:.6g} +- {:.3g} over {} observations, warm-up {} until t={:.0f} "
+                         "(whole run {:.6g})".format(m, e.mean, e.half, e.count, e.warmup, e.warmup_time, e.raw_mean))
+        return "\n".join(lines)
@@ -0,0 +1,73 @@
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+def grid(base, **axes):
+    """
+        Expands a parameter grid. `base` is a namedtuple of defaults and every
+        keyword is a field name with the list of values to sweep, e.g.
+        grid(Params(), P_DELAY=[0.1, 0.9], NUM_RUNWAYS=[1, 2]).
+    """
+    unknown = set(axes) - set(base._fields)
+    if unknown:
+        raise ValueError("unknown parameter(s): {}".format(", ".join(sorted(unknown))))
+    names = list(axes)
+    return [base._replace(**dict(zip(names, values)))
+            for values in itertools.product(*(axes[name] for name in names))]
+
+def parse_axis(text):
+    # "NAME=v1,v2,..." from the command line
+    name, _, values = text.partition("=")
+    if not values:
+        raise ValueError("expected NAME=v1,v2,... but got {!r}".format(text))
+    return name.strip(), [float(v) if "." in v or "e" in v else int(v) for v in values.split(",")]
+
+def run(fn, points, path, seed=None, workers=None, common=False, append=False):
+    """
+        Evaluates fn(point, seed_sequence) for every grid point over a process
+        pool and appends the returned rows (a list of dicts) to the CSV file at
+        `path` as soon as each point finishes, prefixed with the point's
+        parameters. Yields (point, rows) in completion order. Each point gets
+        its own child of SeedSequence(seed) by grid index, so results don't
+        depend on the number of workers or the completion order. With
+        common=True every point gets the same seed instead (common random
+        numbers), so differences between points aren't drowned in noise.
+        With append=True the rows go after those already in the file, e.g.
+        from an earlier round of an adaptive search.
+    """
+    root = np.random.SeedSequence(seed)
+    if common:
+        # Separate but equal objects, spawning from one mustn't shift another
+        children = [np.random.SeedSequence(root.entropy) for _ in points]
+    else:
+        children = root.spawn(len(points))
+    with open(path, "a" if append else "w", newline="") as f:
+        writer = None
+
+        def write(point, rows):
+            nonlocal writer
+            for row in rows:
+                row = {**point._asdict(), **row}
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(row))
+                    if not f.tell():
+                        writer.writeheader()
+                writer.writerow(row)
+            f.flush()
+
+        if workers == 1:
+            for point, child in zip(points, children):
+                rows = fn(point, child)
+                write(point, rows)
+                yield point, rows
+            return
+
+        with ProcessPoolExecutor(workers or os.cpu_count()) as ex:
+            futures = {ex.submit(fn, point, child): point for point, child in zip(points, children)}
+            for future in as_completed(futures):
+                point = futures[future]
+                rows = future.result()
+                write(point, rows)
+                yield point, rows
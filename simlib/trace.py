@@ -0,0 +1,109 @@
+import math
+import os
+import numpy as np
+
+# Rows buffered in memory before they go to disk, and rows per replay chunk
+CHUNK = 1 << 16
+
+# Header room for the largest row count the headers will ever get
+_HEADER_ROWS = 10**18
+
+def _header(dtype, shape, size=None):
+    # .npy version 1.0 header, padded with spaces to `size` bytes
+    text = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": shape})
+    if size is None:
+        size = 64*math.ceil((10 + len(text) + 1)/64)
+    text = text.ljust(size - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + (size - 10).to_bytes(2, "little") + text.encode("latin1")
+
+class TraceWriter:
+    """
+        Records rows of an input trace (arrival times, routing choices, service
+        demands, ...) as a directory with one .npy file per column:
+
+            with TraceWriter("trace", time=float, flow=np.int32, service=(float, 2)) as w:
+                w.append(time=t, flow=f, service=[s1, s2])
+
+        A column given as (dtype, width) holds `width` values per row. Rows are
+        buffered in blocks of `chunk` and written straight to the files, whose
+        headers get the final row count on close(), so recording needs no
+        more memory than one block.
+    """
+    def __init__(self, path, chunk=CHUNK, **columns):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk = chunk
+        self.n = 0
+        self.i = 0
+        self.buf, self.files, self.headers = {}, {}, {}
+        for name, spec in columns.items():
+            dtype, width = spec if isinstance(spec, tuple) else (spec, None)
+            dtype = np.dtype(dtype)
+            shape = (chunk,) if width is None else (chunk, width)
+            self.buf[name] = np.zeros(shape, dtype=dtype)
+            f = open(os.path.join(path, name + ".npy"), "wb")
+            size = len(_header(dtype, (_HEADER_ROWS,) + shape[1:]))
+            f.write(_header(dtype, (0,) + shape[1:], size))
+            self.files[name] = f
+            self.headers[name] = size
+
+    def append(self, **values):
+        for name, value in values.items():
+            self.buf[name][self.i] = value
+        self.i += 1
+        if self.i == self.chunk:
+            self.flush()
+
+    def flush(self):
+        # Appends the buffered rows, then rewrites the headers to cover them
+        self.n += self.i
+        for name, buf in self.buf.items():
+            f = self.files[name]
+            f.write(buf[:self.i].tobytes())
+            buf[:self.i] = 0
+            f.seek(0)
+            f.write(_header(buf.dtype, (self.n,) + buf.shape[1:], self.headers[name]))
+            f.seek(0, os.SEEK_END)
+            f.flush()
+        self.i = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class TraceReader:
+    """
+        Replays a trace written by TraceWriter. The columns are memory-mapped,
+        and rows() copies one chunk at a time out of the maps, so a trace far
+        bigger than RAM replays at disk speed.
+    """
+    def __init__(self, path, chunk=CHUNK):
+        self.chunk = chunk
+        self.columns = {name[:-4]: np.load(os.path.join(path, name), mmap_mode="r")
+                        for name in sorted(os.listdir(path)) if name.endswith(".npy")}
+        lengths = {len(c) for c in self.columns.values()}
+        if len(lengths) != 1:
+            raise ValueError("trace columns in {} differ in length".format(path))
+        self.n = lengths.pop()
+
+    def __len__(self):
+        return self.n
+
+    def chunks(self, *names):
+        # Dicts of arrays for `names` (default: all columns), chunk rows each
+        names = names or list(self.columns)
+        for start in range(0, self.n, self.chunk):
+            yield {name: np.array(self.columns[name][start:start + self.chunk]) for name in names}
+
+    def rows(self, *names):
+        # Tuples of plain Python values in column order; width columns give lists
+        names = names or list(self.columns)
+        for chunk in self.chunks(*names):
+            yield from zip(*(chunk[name].tolist() for name in names))